@@ -0,0 +1,149 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+COMMISSION = 0.001
+
+
+class ArbitrageGraph:
+    """
+    Assets as integer nodes and the trading pairs as edges of a dense adjacency matrix, the cycles are enumerated
+    once with array operations and every tick only evaluates the products of their conversion rates
+    """
+
+    def __init__(self, symbols, base_assets, quote_assets):
+        self.symbols = np.asarray(symbols, dtype=object)
+        self.assets = np.array(sorted(set(base_assets) | set(quote_assets)), dtype=object)
+        asset_ids = {a: i for i, a in enumerate(self.assets)}
+        self.base = np.array([asset_ids[a] for a in base_assets], dtype=np.int64)
+        self.quote = np.array([asset_ids[a] for a in quote_assets], dtype=np.int64)
+
+        n = len(self.assets)
+        # pair_index[i, j] is the pair trading i against j in either direction, -1 if there is none
+        self.pair_index = np.full((n, n), -1, dtype=np.int64)
+        self.pair_index[self.base, self.quote] = np.arange(len(self.symbols))
+        self.pair_index[self.quote, self.base] = np.arange(len(self.symbols))
+        self.adjacency = self.pair_index >= 0
+        self.cycles = np.empty((0, 3), dtype=np.int64)
+        self.steps = np.empty((0, 3), dtype=np.int64)
+        self.sells = np.empty((0, 3), dtype=bool)
+
+    @classmethod
+    def from_exchange_info(cls, exchange_info):
+        """
+        exchange_info is the symbols DataFrame of get_exchange_info(get_all=True), only the pairs which trade are used
+        """
+        exchange_info = pd.DataFrame(exchange_info)
+        if 'status' in exchange_info.columns:
+            exchange_info = exchange_info[exchange_info['status'] == 'TRADING']
+        return cls(exchange_info['symbol'].values, exchange_info['baseAsset'].values,
+                   exchange_info['quoteAsset'].values)
+
+    def triangles(self):
+        """
+        (i, j, k) with i < j < k of every triangle of the graph, from the common neighbours of the ends of each edge
+        """
+        i, j = np.nonzero(np.triu(self.adjacency, k=1))
+        common = self.adjacency[i] & self.adjacency[j]
+        common &= np.arange(len(self.assets))[None, :] > j[:, None]
+        edge, k = np.nonzero(common)
+        return np.stack([i[edge], j[edge], k], axis=1)
+
+    def quadrilaterals(self):
+        """
+        (i, j, k, l) of every cycle i -> j -> k -> l -> i where i is the smallest node, j < l and k is opposite to i
+        """
+        n = len(self.assets)
+        nodes = np.arange(n)
+        cycles = []
+        for i in range(n):
+            neighbours = np.flatnonzero(self.adjacency[i] & (nodes > i))
+            if len(neighbours) < 2:
+                continue
+            a, b = np.triu_indices(len(neighbours), k=1)
+            j, l = neighbours[a], neighbours[b]
+            common = self.adjacency[j] & self.adjacency[l]
+            common &= nodes[None, :] > i
+            pair, k = np.nonzero(common)
+            cycles.append(np.stack([np.full(len(k), i), j[pair], k, l[pair]], axis=1))
+        if len(cycles) == 0:
+            return np.empty((0, 4), dtype=np.int64)
+        return np.concatenate(cycles)
+
+    def build_cycles(self, length=3):
+        """
+        Directed cycles of the given length (3 or 4), both directions of each, with the pair and side of every step
+        """
+        if length == 3:
+            undirected = self.triangles()
+        elif length == 4:
+            undirected = self.quadrilaterals()
+        else:
+            raise ValueError("only cycles of 3 or 4 assets are supported")
+        self.cycles = np.concatenate([undirected, undirected[:, ::-1]])
+        start = self.cycles
+        end = np.roll(self.cycles, -1, axis=1)
+        self.steps = self.pair_index[start, end]
+        # converting the base asset into the quote asset sells at the bid, the other way buys at the ask
+        self.sells = self.base[self.steps] == start
+        return self.cycles
+
+    def price_vectors(self, book_ticker):
+        """
+        bid and ask arrays aligned with the pairs from a book ticker (symbol, bidPrice, askPrice) or a price ticker
+        (symbol, price), the pairs missing from it are nan
+        """
+        book_ticker = pd.DataFrame(book_ticker).set_index('symbol').reindex(self.symbols)
+        if 'bidPrice' in book_ticker.columns:
+            bid, ask = book_ticker['bidPrice'], book_ticker['askPrice']
+        else:
+            bid = ask = book_ticker['price']
+        return bid.values.astype(np.float64), ask.values.astype(np.float64)
+
+    def evaluate(self, bid, ask, commission=COMMISSION):
+        """
+        Return of every cycle after commission, one multiplication per step over all cycles at once
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rates = np.where(self.sells, bid[self.steps], 1 / ask[self.steps]) * (1 - commission)
+            rates[~np.isfinite(rates) | (rates <= 0)] = np.nan
+        return rates.prod(axis=1) - 1
+
+    def opportunities(self, book_ticker, commission=COMMISSION, min_profit=0.0):
+        """
+        Cycles with a return above min_profit, best first
+        """
+        bid, ask = self.price_vectors(book_ticker)
+        profit = self.evaluate(bid, ask, commission)
+        rows = np.flatnonzero(profit > min_profit)
+        rows = rows[np.argsort(-profit[rows])]
+        return pd.DataFrame({'path': [list(p) for p in self.assets[self.cycles[rows]]],
+                             'symbols': [list(s) for s in self.symbols[self.steps[rows]]],
+                             'profit': profit[rows]})
+
+    def paths_by_asset(self):
+        """
+        {asset: [[second, ..., asset], ...]} of the cycles through each asset, the layout of arbitrage_paths.json
+        """
+        paths = {a: [] for a in self.assets}
+        for cycle in self.assets[self.cycles]:
+            for shift in range(len(cycle)):
+                rotated = np.roll(cycle, -shift)
+                paths[rotated[0]].append(list(rotated[1:]) + [rotated[0]])
+        return paths
+
+    def save_paths(self, path):
+        with open(path, "w") as handle:
+            json.dump(self.paths_by_asset(), handle)
+
+
+if __name__ == "__main__":
+    from data_analysis.data_getter import DataGetterSymbolList
+    from data_analysis.exchange_info import ExchangeInfoCache
+
+    graph = ArbitrageGraph.from_exchange_info(ExchangeInfoCache(r"G:\crypto\data\exchange").to_frame())
+    graph.build_cycles(3)
+    print(f"{len(graph.assets)} assets, {len(graph.symbols)} pairs, {len(graph.cycles)} cycles")
+    prices = DataGetterSymbolList(list(graph.symbols)).get_order_books(save=False).reset_index()
+    print(graph.opportunities(prices).head(20))
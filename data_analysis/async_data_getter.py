@@ -0,0 +1,303 @@
+import asyncio
+import collections
+import concurrent.futures
+import json
+import os
+import time
+
+import aiohttp
+import numpy as np
+import pandas as pd
+
+from data_analysis.constants import VALID_INTERVALS, VALID_INTERVALS_TO_TIME
+from data_analysis.data_getter import API_PATHS, START_HIST, THREADS, MAX_RETRIES, FLUSH_PAGES, \
+    BinanceRequestException, get_request_weight
+from data_analysis.exchange_info import ExchangeInfoCache
+from data_analysis.gaps import CANDLES_PER_REQUEST, gap_windows, scan_store_gaps
+from data_analysis.http_session import BACKOFF_FACTOR, RETRY_STATUSES, TIMEOUT
+from data_analysis.kline_decoder import decode_klines
+from data_analysis.rate_limiter import get_rate_limiter
+
+QUEUE_SIZE_PER_WORKER = 4
+# series of the store with failed windows when no manifest keeps track of them, downloaded again by the next run
+INCOMPLETE_FILE = "_incomplete_downloads.json"
+
+
+class AsyncDataGetter:
+    """
+    Downloads the candles of many symbols through one global queue of (symbol, window) requests, so the connection
+    stays busy across symbols instead of idling while a per-symbol thread pool starts and stops
+    """
+
+    def __init__(self, symbols, base_save_path=None, concurrency=THREADS, rate_limiter=None, store=None,
+                 manifest=None):
+        if (manifest is not None) and (store is None):
+            raise ValueError("the download manifest needs a store to flush the candles to")
+        self.symbols = list(symbols)
+        self.base_save_path = base_save_path
+        self.store = store
+        self.manifest = manifest
+        self.concurrency = concurrency
+        self.rate_limiter = get_rate_limiter() if rate_limiter is None else rate_limiter
+        self.failed_windows = []
+
+    async def _get(self, session, request_type, params, raw=False):
+        """
+        Same retries as send_request: after the backoff on 429 and server errors, each attempt with its own
+        reservation of the rate limiter
+        """
+        weight = get_request_weight(request_type, params)
+        params = {k: str(v) for k, v in params.items()}
+        for attempt in range(MAX_RETRIES):
+            await self.rate_limiter.acquire_async(weight)
+            try:
+                async with session.get(API_PATHS[request_type], params=params) as resp:
+                    content = await resp.read()
+                    headers, status = resp.headers, resp.status
+            except Exception:
+                self.rate_limiter.release(weight)
+                raise
+            self.rate_limiter.release(weight, headers, status)
+            if status == 429:
+                continue
+            if status in RETRY_STATUSES:
+                await asyncio.sleep(BACKOFF_FACTOR * 2 ** attempt)
+                continue
+            if status >= 400:
+                raise BinanceRequestException(content.decode(), status)
+            return content if raw else json.loads(content)
+        if status in RETRY_STATUSES:
+            raise BinanceRequestException(content.decode(), status)
+        raise BinanceRequestException(f"Rate limit still exceeded after {MAX_RETRIES} retries", 429)
+
+    def _get_file_name(self, symbol, interval):
+        return os.path.join(self.base_save_path, f"{symbol}_{interval}.csv")
+
+    def _incomplete_path(self):
+        return os.path.join(self.store.base_path, INCOMPLETE_FILE)
+
+    def _incomplete(self):
+        if (self.store is None) or (self.manifest is not None) or not os.path.exists(self._incomplete_path()):
+            return set()
+        with open(self._incomplete_path()) as handle:
+            return set(json.load(handle))
+
+    def _set_incomplete(self, symbol, interval, incomplete):
+        series = self._incomplete()
+        if (f"{symbol}|{interval}" in series) == incomplete:
+            return
+        if incomplete:
+            series.add(f"{symbol}|{interval}")
+        else:
+            series.discard(f"{symbol}|{interval}")
+        os.makedirs(self.store.base_path, exist_ok=True)
+        with open(self._incomplete_path() + ".tmp", "w") as handle:
+            json.dump(sorted(series), handle)
+        os.replace(self._incomplete_path() + ".tmp", self._incomplete_path())
+
+    def _exists(self, symbol, interval, incomplete=()):
+        if self.store is not None:
+            return self.store.exists(symbol, interval) and not (
+                    (self.manifest is not None) and self.manifest.is_unfinished(symbol, interval)) and \
+                f"{symbol}|{interval}" not in incomplete
+        return os.path.exists(self._get_file_name(symbol, interval))
+
+    async def _get_windows(self, session, symbol, interval, start_time, end_time):
+        # the first candle of the symbol, so that no requests are wasted before it was listed
+        first = await self._get(session, "CANDLES", {"symbol": symbol, "interval": interval, "startTime": start_time,
+                                                     "endTime": end_time, "limit": 1})
+        if len(first) == 0:
+            return []
+        start_time = int(first[0][0])
+        window = VALID_INTERVALS_TO_TIME[interval] * CANDLES_PER_REQUEST
+        range_start = np.arange(start_time, end_time, window)
+        range_end = np.minimum(range_start + window - 1, end_time)
+        return list(zip(range_start.tolist(), range_end.tolist()))
+
+    async def _get_series_windows(self, session, symbol, interval, start_time, end_time):
+        if self.manifest is None:
+            return await self._get_windows(session, symbol, interval, start_time, end_time)
+        # the windows are rebuilt from the start of the interrupted download so they match the completed ones
+        start_time = self.manifest.start(symbol, interval, start_time)
+        completed = self.manifest.completed_windows(symbol, interval)
+        windows = await self._get_windows(session, symbol, interval, start_time, end_time)
+        return [w for w in windows if w not in completed]
+
+    def _save(self, symbol, interval, pages):
+        pages = [page for page in pages if len(page) > 0]
+        if len(pages) == 0:
+            return
+        data = pd.concat(pages, ignore_index=True)
+        data = data.sort_values(by='open_time').drop_duplicates(subset='open_time')
+        if self.store is not None:
+            self.store.write(symbol, interval, data)
+        else:
+            data.to_csv(self._get_file_name(symbol, interval), index=False)
+
+    def _save_chunk(self, symbol, interval, pages, windows, finished, incomplete=False):
+        if incomplete and (self.store is None):
+            # a csv with holes would be taken as complete by the next run
+            print(f"{symbol} {interval}: not saved as some windows failed")
+            return
+        self._save(symbol, interval, pages)
+        if self.manifest is not None:
+            self.manifest.mark_completed(symbol, interval, windows)
+            if finished:
+                self.manifest.finish(symbol, interval)
+        elif (self.store is not None) and (finished or incomplete):
+            self._set_incomplete(symbol, interval, incomplete)
+
+    def _client_session(self):
+        timeout = aiohttp.ClientTimeout(sock_connect=TIMEOUT[0], sock_read=TIMEOUT[1])
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        return aiohttp.ClientSession(timeout=timeout, connector=connector)
+
+    async def _download(self, session, batches, finish=False):
+        """
+        Pushes the windows of every (symbol, interval, windows) batch through the same queue and workers, each series
+        is saved as soon as its last window is in. With a store the pages are also flushed every FLUSH_PAGES windows
+        and, when finish is set, the series whose windows all succeeded are finished in the manifest while the others
+        are left for the next run, a csv is only written when all its windows succeeded.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.concurrency * QUEUE_SIZE_PER_WORKER)
+        pages = collections.defaultdict(list)
+        windows_done = collections.defaultdict(list)
+        remaining = collections.defaultdict(int)
+        failed = collections.defaultdict(int)
+        saves = []
+        # one thread so that the chunks of a series are written in order
+        save_executor = concurrent.futures.ThreadPoolExecutor(1)
+
+        def save(key, finished=False, incomplete=False):
+            saves.append(loop.run_in_executor(save_executor, self._save_chunk, *key, pages.pop(key, []),
+                                              windows_done.pop(key, []), finished, incomplete))
+
+        def window_done(symbol, interval):
+            key = (symbol, interval)
+            remaining[key] -= 1
+            if remaining[key] == 0:
+                complete = failed.pop(key, 0) == 0
+                save(key, finish and complete, finish and not complete)
+                print(f"{symbol} {interval}: Done" if complete else f"{symbol} {interval}: Done with failed windows")
+            elif (self.store is not None) and len(pages[key]) >= FLUSH_PAGES:
+                save(key)
+
+        async def worker():
+            while True:
+                symbol, interval, window_start, window_end = await queue.get()
+                try:
+                    page = decode_klines(await self._get(session, "CANDLES", {
+                        "symbol": symbol, "interval": interval, "startTime": window_start, "endTime": window_end,
+                        "limit": CANDLES_PER_REQUEST}, raw=True))
+                    pages[(symbol, interval)].append(page)
+                    windows_done[(symbol, interval)].append((window_start, window_end, len(page)))
+                except Exception as err:
+                    print(f"error for {symbol} {window_start} and {window_end}: {err}")
+                    self.failed_windows.append((symbol, interval, window_start, window_end))
+                    failed[(symbol, interval)] += 1
+                finally:
+                    window_done(symbol, interval)
+                    queue.task_done()
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(self.concurrency)]
+        async for symbol, interval, windows in batches:
+            remaining[(symbol, interval)] += len(windows)
+            for window_start, window_end in windows:
+                await queue.put((symbol, interval, window_start, window_end))
+        await queue.join()
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*saves)
+        save_executor.shutdown()
+
+    async def run(self, start_date=START_HIST, interval='1m', end_date=None):
+        if interval not in VALID_INTERVALS:
+            raise ValueError("Invalid Interval")
+
+        self.failed_windows = []
+        async with self._client_session() as session:
+            server_time = (await self._get(session, "TIME", {}))['serverTime']
+            end_time = server_time if end_date is None else int(
+                (pd.to_datetime(end_date, dayfirst=True) + pd.DateOffset(days=1)).to_datetime64().view('<i8') / 10e5) \
+                - 1
+            start_time = int(pd.to_datetime(start_date, dayfirst=True).to_datetime64().view('<i8') / 10e5)
+            incomplete = self._incomplete()
+            symbols = [s for s in self.symbols if not self._exists(s, interval, incomplete)]
+
+            async def batches():
+                # the windows of the next symbols are looked up while the current ones are being downloaded
+                lookups = collections.deque()
+                symbols_iter = iter(symbols)
+                for symbol in symbols_iter:
+                    lookups.append((symbol, asyncio.ensure_future(
+                        self._get_series_windows(session, symbol, interval, start_time, end_time))))
+                    if len(lookups) >= self.concurrency:
+                        break
+                while len(lookups) > 0:
+                    symbol, lookup = lookups.popleft()
+                    next_symbol = next(symbols_iter, None)
+                    if next_symbol is not None:
+                        lookups.append((next_symbol, asyncio.ensure_future(
+                            self._get_series_windows(session, next_symbol, interval, start_time, end_time))))
+                    try:
+                        windows = await lookup
+                    except Exception as err:
+                        print(f"error for {symbol}: {err}")
+                        self.failed_windows.append((symbol, interval, start_time, end_time))
+                        continue
+                    if len(windows) == 0:
+                        print(f"{symbol}: No data")
+                        if self.manifest is not None:
+                            self.manifest.finish(symbol, interval)
+                        continue
+                    yield symbol, interval, windows
+
+            started = time.time()
+            await self._download(session, batches(), finish=True)
+            print(f"Downloading {len(symbols)} symbols took {time.time() - started} seconds")
+
+        return self.failed_windows
+
+    async def run_windows(self, windows):
+        """
+        Downloads explicit (symbol, interval, start, end) windows, e.g. the ones of gap_windows
+        """
+        grouped = collections.defaultdict(list)
+        for symbol, interval, window_start, window_end in windows:
+            grouped[(symbol, interval)].append((int(window_start), int(window_end)))
+
+        async def batches():
+            for (symbol, interval), series_windows in grouped.items():
+                yield symbol, interval, series_windows
+
+        self.failed_windows = []
+        async with self._client_session() as session:
+            started = time.time()
+            await self._download(session, batches())
+            print(f"Downloading {len(windows)} windows took {time.time() - started} seconds")
+
+        return self.failed_windows
+
+
+def fill_store_gaps(store, symbols=None, interval='1m', concurrency=THREADS):
+    """
+    Scans the store for gaps and fills all of them through one request queue
+    """
+    gaps = scan_store_gaps(store, symbols, interval)
+    if len(gaps) == 0:
+        print("there are no gaps")
+        return []
+    windows = gap_windows(gaps)
+    print(f"{len(gaps)} gaps in {gaps['symbol'].nunique()} symbols packed into {len(windows)} requests")
+    getter = AsyncDataGetter(gaps['symbol'].unique(), concurrency=concurrency, store=store)
+    return asyncio.run(getter.run_windows(windows))
+
+
+if __name__ == "__main__":
+    base_save_p = r"D:\crypto\data\symbols"
+
+    exchange_info = ExchangeInfoCache(r"G:\crypto\data\exchange").load()
+    getter = AsyncDataGetter(exchange_info.symbols(status=None), base_save_p)
+    failed = asyncio.run(getter.run(START_HIST, '1m'))
+    print(f"{len(failed)} windows failed")
@@ -1,2 +1,151 @@
+import numpy as np
 import pandas as pd
-import numpy as np
\ No newline at end of file
+
+from data_analysis.indicators import as_2d, cross_signals, ewma
+from data_analysis.panel import MarketPanel
+
+CASH = 10000
+COMMISSION = 0.002
+# share of the equity put in each trade, the default of backtesting.py
+TRADE_SIZE = 0.9999
+
+
+def ewma_cross_signals(close, fast_hl, slow_hl):
+    """
+    +1 on the bars where the fast ewma crosses above the slow one, -1 where it crosses below
+    """
+    return cross_signals(as_2d(ewma(close, fast_hl)), as_2d(ewma(close, slow_hl)))
+
+
+def load_prices(store, symbols, interval, start=None, end=None):
+    """
+    (open_time, open, close) of the symbols aligned on a common time axis, nan where a symbol has no candle
+    """
+    panel = MarketPanel(store, symbols, interval, fields=['open', 'close']).load(start, end)
+    return panel.open_times, panel['open'], panel['close']
+
+
+class BacktestResult:
+
+    def __init__(self, trades, stats, equity=None):
+        self.trades = trades
+        self.stats = stats
+        self.equity = equity
+
+
+class VectorizedBacktest:
+    """
+    Backtest of signals over (bars x symbols) prices with the semantics of backtesting.py's
+    Backtest(..., exclusive_orders=True): a signal on a bar is filled at the open of the next bar, closes the open
+    trade of the symbol and opens a new one in its direction with TRADE_SIZE of the equity, in whole units unless
+    fractional is set. Commission makes buys fill at price * (1 + commission) and sells at price * (1 - commission).
+    The trade still open at the end is closed at the last close.
+
+    Signals, entries and exits are found with array operations over every symbol, only the compounding of the equity
+    goes trade by trade.
+    """
+
+    def __init__(self, open_, close, cash=CASH, commission=COMMISSION, fractional=False, size=TRADE_SIZE):
+        self.close = as_2d(close)
+        # a symbol missing a candle inside its history fills at the last close
+        self.open = np.where(np.isnan(as_2d(open_)), pd.DataFrame(self.close).ffill().values, as_2d(open_))
+        self.cash = cash
+        self.commission = commission
+        self.fractional = fractional
+        self.size = size
+        valid = ~np.isnan(self.close)
+        n_bars = len(self.close)
+        self.first_bar = np.where(valid.any(axis=0), valid.argmax(axis=0), n_bars)
+        self.last_bar = np.where(valid.any(axis=0), n_bars - 1 - valid[::-1].argmax(axis=0), -1)
+
+    def _trades(self, signals):
+        signals = np.array(as_2d(signals), copy=True)
+        # the signals from the last bar of a symbol on are never filled, the last bar of the data included
+        signals[np.arange(len(signals))[:, None] >= self.last_bar[None, :]] = 0
+        column, bar = np.nonzero(signals.T)
+        direction = signals[bar, column].astype(np.int64)
+        entry_bar = bar + 1
+        same_column = np.r_[column[1:] == column[:-1], False]
+        exit_bar = np.where(same_column, np.r_[entry_bar[1:], 0], self.last_bar[column])
+        closed_at_end = ~same_column
+        entry_price = self.open[entry_bar, column]
+        exit_price = np.where(closed_at_end, self.close[exit_bar, column], self.open[exit_bar, column])
+        return column, direction, entry_bar, exit_bar, entry_price, exit_price
+
+    def _compound(self, column, direction, entry_price, exit_price):
+        """
+        Units and equity before and after every trade, the only step which depends on the previous trades
+        """
+        entry_fill = entry_price * (1 + direction * self.commission)
+        exit_fill = exit_price * (1 - direction * self.commission)
+        units = np.zeros(len(column))
+        equity_before = np.zeros(len(column))
+        equity_after = np.zeros(len(column))
+        equity = self.cash
+        for k in range(len(column)):
+            if (k == 0) or (column[k] != column[k - 1]):
+                equity = self.cash
+            equity_before[k] = equity
+            amount = self.size * equity / entry_fill[k]
+            amount = amount if self.fractional else np.floor(amount)
+            if (amount > 0) and np.isfinite(amount):
+                units[k] = amount
+                equity += amount * direction[k] * (exit_fill[k] - entry_fill[k])
+            equity_after[k] = equity
+        return units, entry_fill, exit_fill, equity_before, equity_after
+
+    def _equity(self, col, trades):
+        """
+        Equity of one symbol on every bar, the open trade is marked to market at the close like backtesting.py does
+        """
+        close = pd.Series(self.close[:, col]).ffill().values
+        bars = np.arange(len(close))
+        equity = np.full(len(close), float(self.cash))
+        if len(trades) > 0:
+            k = np.searchsorted(trades['entry_bar'].values, bars, side='right') - 1
+            started = k >= 0
+            k = np.maximum(k, 0)
+            in_trade = started & (bars < trades['exit_bar'].values[k]) & (trades['units'].values[k] > 0)
+            marked = trades['equity_before'].values[k] + trades['units'].values[k] * trades['direction'].values[k] * (
+                    close - trades['entry_fill'].values[k])
+            equity = np.where(in_trade, marked, np.where(started, trades['equity_after'].values[k], equity))
+            # the bar a trade closes on already holds its result
+            last = trades['exit_bar'].values[-1]
+            equity[last:] = trades['equity_after'].values[-1]
+        equity[:self.first_bar[col]] = self.cash
+        return equity
+
+    def run(self, signals, symbols=None, keep_equity=False):
+        signals = as_2d(signals)
+        symbols = list(range(signals.shape[1])) if symbols is None else list(symbols)
+        column, direction, entry_bar, exit_bar, entry_price, exit_price = self._trades(signals)
+        units, entry_fill, exit_fill, equity_before, equity_after = self._compound(column, direction, entry_price,
+                                                                                   exit_price)
+        trades = pd.DataFrame({'symbol': np.asarray(symbols, dtype=object)[column], 'direction': direction,
+                               'entry_bar': entry_bar, 'exit_bar': exit_bar, 'entry_price': entry_price,
+                               'exit_price': exit_price, 'entry_fill': entry_fill, 'exit_fill': exit_fill,
+                               'units': units, 'pnl': units * direction * (exit_fill - entry_fill),
+                               'equity_before': equity_before, 'equity_after': equity_after})
+        trades['return'] = direction * (exit_fill - entry_fill) / entry_fill
+
+        stats = []
+        equities = {}
+        bounds = np.searchsorted(column, np.arange(signals.shape[1] + 1))
+        for col, symbol in enumerate(symbols):
+            symbol_trades = trades.iloc[bounds[col]:bounds[col + 1]]
+            equity = self._equity(col, symbol_trades)
+            if keep_equity:
+                equities[symbol] = equity
+            filled = symbol_trades[symbol_trades['units'] > 0]
+            peak = np.maximum.accumulate(equity)
+            first, last = self.first_bar[col], self.last_bar[col]
+            in_market = ((filled['exit_bar'] - filled['entry_bar']).sum() / (last - first + 1)) if last >= first else 0
+            stats.append({'symbol': symbol, 'equity_final': equity[-1],
+                          'return_pct': (equity[-1] / self.cash - 1) * 100,
+                          'buy_hold_return_pct': ((self.close[last, col] / self.close[first, col] - 1) * 100
+                                                  if last >= first else np.nan),
+                          'max_drawdown_pct': ((equity / peak).min() - 1) * 100, 'trades': len(filled),
+                          'win_rate_pct': (filled['pnl'] > 0).mean() * 100 if len(filled) > 0 else np.nan,
+                          'exposure_pct': in_market * 100})
+        equity = pd.DataFrame(equities) if keep_equity else None
+        return BacktestResult(trades, pd.DataFrame(stats).set_index('symbol'), equity)
@@ -0,0 +1,136 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_analysis.candle_store import DAY_MILLISECONDS, to_milliseconds
+from data_analysis.constants import CANDLES_DTYPE, CANDLES_HEADER, VALID_INTERVALS_TO_TIME
+
+MAGIC = b"CNDL"
+VERSION = 1
+BINARY_EXTENSION = ".candles"
+# 64 bytes so that the records after it stay aligned
+HEADER_DTYPE = np.dtype([('magic', 'S4'), ('version', '<u4'), ('interval', '<i8'), ('rows', '<i8'),
+                         ('reserved', 'V40')])
+
+
+def binary_path(base_path, symbol, interval):
+    return os.path.join(base_path, f"{symbol}_{interval}{BINARY_EXTENSION}")
+
+
+def to_records(data):
+    """
+    Candles sorted by open_time as an array of CANDLES_DTYPE
+    """
+    if isinstance(data, np.ndarray) and data.dtype == CANDLES_DTYPE:
+        records = data
+    else:
+        data = pd.DataFrame(data)
+        records = np.empty(len(data), dtype=CANDLES_DTYPE)
+        for column in CANDLES_HEADER:
+            records[column] = data[column].values
+    if len(records) > 1 and np.any(np.diff(records['open_time']) < 0):
+        records = np.sort(records, order='open_time', kind='stable')
+    return records
+
+
+def _read_header(path):
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header['magic'][0] != MAGIC:
+        raise ValueError(f"{path} is not a candles file")
+    if header['version'][0] != VERSION:
+        raise ValueError(f"{path} has version {header['version'][0]}, expected {VERSION}")
+    return header[0]
+
+
+def write_candles_binary(path, data, interval):
+    records = to_records(data)
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['interval'] = VALID_INTERVALS_TO_TIME[interval]
+    header['rows'] = len(records)
+    with open(path + ".tmp", 'wb') as handle:
+        handle.write(header.tobytes())
+        handle.write(records.tobytes())
+    os.replace(path + ".tmp", path)
+
+
+def append_candles_binary(path, data):
+    """
+    Appends the candles opened after the last one in the file, the row count in the header is only updated once the
+    records are on disk so readers never see a partial record
+    """
+    rows = int(_read_header(path)['rows'])
+    records = to_records(data)
+    if rows > 0:
+        last = np.memmap(path, dtype=CANDLES_DTYPE, mode='r', offset=HEADER_DTYPE.itemsize, shape=(rows,))
+        records = records[records['open_time'] > last['open_time'][-1]]
+        del last
+    if len(records) == 0:
+        return 0
+
+    with open(path, 'r+b') as handle:
+        handle.seek(HEADER_DTYPE.itemsize + rows * CANDLES_DTYPE.itemsize)
+        handle.write(records.tobytes())
+        handle.truncate()
+        handle.flush()
+        os.fsync(handle.fileno())
+        handle.seek(HEADER_DTYPE.fields['rows'][1])
+        handle.write(np.array([rows + len(records)], dtype='<i8').tobytes())
+    return len(records)
+
+
+def export_store_to_binary(store, symbol, interval, path):
+    """
+    Writes a series of the CandleStore to a candles file one day at a time
+    """
+    write_candles_binary(path, np.empty(0, dtype=CANDLES_DTYPE), interval)
+    for day in sorted(set(d for d, _ in store.partitions(symbol, interval))):
+        day_data = store.read(symbol, interval, start=day * DAY_MILLISECONDS, end=(day + 1) * DAY_MILLISECONDS - 1)
+        append_candles_binary(path, day_data)
+
+
+class MappedCandles:
+    """
+    Read only memory map of a candles file, nothing is parsed or copied until a slice is used and the pages are
+    shared by every process mapping the same file
+    """
+
+    def __init__(self, path):
+        header = _read_header(path)
+        self.path = path
+        self.interval_milliseconds = int(header['interval'])
+        rows = int(header['rows'])
+        if rows == 0:
+            self.data = np.empty(0, dtype=CANDLES_DTYPE)
+        else:
+            self.data = np.memmap(path, dtype=CANDLES_DTYPE, mode='r', offset=HEADER_DTYPE.itemsize, shape=(rows,))
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def open_time(self):
+        return self.data['open_time']
+
+    def _bounds(self, start=None, end=None):
+        start, end = to_milliseconds(start), to_milliseconds(end)
+        first = 0 if start is None else int(np.searchsorted(self.open_time, start, side='left'))
+        last = len(self.data) if end is None else int(np.searchsorted(self.open_time, end, side='right'))
+        return first, last
+
+    def slice(self, start=None, end=None):
+        """
+        Zero copy view of the candles with start <= open_time <= end, found by binary search
+        """
+        first, last = self._bounds(start, end)
+        return self.data[first:last]
+
+    def column(self, name, start=None, end=None):
+        return self.slice(start, end)[name]
+
+    def to_frame(self, start=None, end=None, columns=None):
+        records = self.slice(start, end)
+        columns = CANDLES_HEADER if columns is None else columns
+        return pd.DataFrame({c: np.asarray(records[c]) for c in columns})
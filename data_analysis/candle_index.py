@@ -0,0 +1,151 @@
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_analysis.candle_store import to_milliseconds
+from data_analysis.constants import CANDLES_HEADER, CANDLES_HEADER_TYPES
+
+INDEX_STRIDE = 10000
+INDEX_SUFFIX = ".idx.json"
+SCAN_BLOCK = 64 * 1024 ** 2
+
+
+class CsvIndex:
+    """
+    Sparse sidecar index of a candles csv sorted by open_time, kept in {path}.idx.json: the open_time and byte offset
+    of every stride-th row together with the row count and the first and last open_time.
+
+    read_range seeks to the block before start and parses only up to the block after end, so a day out of a six year
+    1m file parses about a day of rows. The index is built by scanning the file for line starts without parsing it
+    and is only extended when the file just grew, like after an append.
+    """
+
+    def __init__(self, path, stride=INDEX_STRIDE):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.stride = stride
+        self.columns = CANDLES_HEADER
+        self.header = False
+        self.offsets = []
+        self.open_times = []
+        self.rows = 0
+        self.size = 0
+        self.last_line = ""
+        self.min_open_time = None
+        self.max_open_time = None
+        self.sorted = True
+
+    def _state(self):
+        return {'stride': self.stride, 'columns': self.columns, 'header': self.header, 'offsets': self.offsets,
+                'open_times': self.open_times, 'rows': self.rows, 'size': self.size, 'last_line': self.last_line,
+                'min_open_time': self.min_open_time, 'max_open_time': self.max_open_time, 'sorted': self.sorted}
+
+    def _save(self):
+        with open(self.index_path + ".tmp", "w") as handle:
+            json.dump(self._state(), handle)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def _still_valid(self, handle, size):
+        """
+        True when the indexed bytes are still there, i.e. the file is the same or was only appended to
+        """
+        if size < self.size:
+            return False
+        last_line = self.last_line.encode()
+        handle.seek(self.size - len(last_line))
+        return handle.read(len(last_line)) == last_line
+
+    def load(self):
+        size = os.path.getsize(self.path)
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as handle:
+                state = json.load(handle)
+            if state.get('stride') == self.stride:
+                self.__dict__.update(state)
+        with open(self.path, 'rb') as handle:
+            if (self.size > 0) and not self._still_valid(handle, size):
+                self.__init__(self.path, self.stride)
+            if size > self.size:
+                self._scan(handle, size)
+                self._save()
+        return self
+
+    @staticmethod
+    def _open_time(line):
+        return int(float(line.split(b',', 1)[0]))
+
+    def _scan(self, handle, size):
+        """
+        Indexes the rows from self.size to the end of the file
+        """
+        position = self.size
+        if position == 0:
+            first_line = handle.readline()
+            if not first_line[:1].isdigit():
+                self.header = True
+                self.columns = first_line.decode().strip().split(',')
+                position = len(first_line)
+        while position < size:
+            handle.seek(position)
+            block = np.frombuffer(handle.read(SCAN_BLOCK), dtype=np.uint8)
+            newlines = np.flatnonzero(block == ord('\n'))
+            if len(newlines) == 0:
+                # a last line without newline
+                newlines = np.array([len(block) - 1])
+            starts = position + np.r_[0, newlines[:-1] + 1]
+            sampled = starts[(self.rows + np.arange(len(starts))) % self.stride == 0]
+            for offset in sampled:
+                open_time = self._open_time(bytes(block[offset - position:offset - position + 32]))
+                if self.open_times and (open_time < self.open_times[-1]):
+                    self.sorted = False
+                self.offsets.append(int(offset))
+                self.open_times.append(open_time)
+            self.rows += len(starts)
+            self.last_line = bytes(block[int(starts[-1]) - position:int(newlines[-1]) + 1]).decode()
+            position += int(newlines[-1]) + 1
+        self.size = size
+        last_open_time = self._open_time(self.last_line.encode())
+        if (self.max_open_time is not None) and (last_open_time < self.max_open_time):
+            self.sorted = False
+        self.max_open_time = last_open_time
+        if self.min_open_time is None and self.open_times:
+            self.min_open_time = self.open_times[0]
+
+    def _byte_range(self, start, end):
+        if not self.sorted:
+            return self.offsets[0], self.size
+        first = max(int(np.searchsorted(self.open_times, start, side='right')) - 1, 0) if start is not None else 0
+        last = int(np.searchsorted(self.open_times, end, side='right')) if end is not None else len(self.offsets)
+        return self.offsets[first], self.offsets[last] if last < len(self.offsets) else self.size
+
+    def read_range(self, start=None, end=None, columns=None):
+        """
+        Candles with start <= open_time <= end, only the blocks which can hold them are read
+        """
+        start, end = to_milliseconds(start), to_milliseconds(end)
+        dtype = {c: CANDLES_HEADER_TYPES[c] for c in self.columns if c in CANDLES_HEADER_TYPES}
+        if (self.rows == 0) or ((start is not None) and (start > self.max_open_time)) or \
+                ((end is not None) and (end < self.min_open_time)):
+            data = pd.DataFrame({c: pd.Series(dtype=dtype.get(c, object)) for c in self.columns})
+        else:
+            first, last = self._byte_range(start, end)
+            with open(self.path, 'rb') as handle:
+                handle.seek(first)
+                raw = handle.read(last - first)
+            data = pd.read_csv(io.BytesIO(raw), header=None, names=self.columns, dtype=dtype)
+            if start is not None:
+                data = data[data['open_time'].values >= start]
+            if end is not None:
+                data = data[data['open_time'].values <= end]
+            data = data.reset_index(drop=True)
+        return data if columns is None else data[list(columns)]
+
+
+def read_csv_range(path, start=None, end=None, columns=None, stride=INDEX_STRIDE):
+    """
+    read_range of the index of path, built or extended first when needed
+    """
+    return CsvIndex(path, stride).load().read_range(start, end, columns)
@@ -0,0 +1,277 @@
+import glob
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_analysis.constants import CANDLES_HEADER, CANDLES_HEADER_TYPES
+
+DAY_MILLISECONDS = 24 * 60 * 60 * 1000
+META_FILE = "_meta.json"
+
+
+def to_milliseconds(t):
+    """
+    Accepts milliseconds since epoch, dates in the dd/mm/yyyy format used across the repo or anything pandas parses
+    """
+    if t is None:
+        return None
+    if isinstance(t, (int, np.integer)):
+        return int(t)
+    return int(pd.to_datetime(t, dayfirst=True).value // 10 ** 6)
+
+
+def day_to_partition(day):
+    return str(np.datetime64(int(day), 'D')).replace("-", "")
+
+
+def partition_to_day(partition):
+    return int(np.datetime64(f"{partition[:4]}-{partition[4:6]}-{partition[6:8]}", 'D').astype(np.int64))
+
+
+def empty_candles(columns=None):
+    columns = CANDLES_HEADER if columns is None else columns
+    return pd.DataFrame({c: pd.Series(dtype=CANDLES_HEADER_TYPES[c]) for c in columns})
+
+
+def is_segment(path):
+    return "-" in os.path.basename(path)
+
+
+def temp_path(path):
+    # unique per writer so that two processes writing the same file never share a temporary one
+    return f"{path}.{os.getpid()}.{time.time_ns()}.tmp"
+
+
+class CandleStore:
+    """
+    Typed parquet store of candles partitioned as {base_path}/{symbol}/{interval}/{yyyymmdd}.parquet
+
+    Writes never touch the existing files, they add {yyyymmdd}-{segment}.parquet files next to the day which compact
+    later merges into the day file. The last stored open_time of each series is kept in its _meta.json together with
+    the first and last open_time and the rows of every file, which lets read skip the files outside the range. The
+    stats also hold the size and mtime of their file and are ignored once these no longer match, e.g. after a compact
+    whose meta update was lost to a concurrent writer.
+    """
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+
+    def _series_path(self, symbol, interval):
+        return os.path.join(self.base_path, symbol, interval)
+
+    def _partition_path(self, symbol, interval, day, segment=None):
+        name = day_to_partition(day) if segment is None else f"{day_to_partition(day)}-{segment}"
+        return os.path.join(self._series_path(symbol, interval), name + ".parquet")
+
+    def _meta_path(self, symbol, interval):
+        return os.path.join(self._series_path(symbol, interval), META_FILE)
+
+    def _read_meta(self, symbol, interval):
+        path = self._meta_path(symbol, interval)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as handle:
+            return json.load(handle)
+
+    def _write_meta(self, symbol, interval, meta):
+        path = self._meta_path(symbol, interval)
+        tmp_path = temp_path(path)
+        with open(tmp_path, "w") as handle:
+            json.dump(meta, handle)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _file_stats(data, path):
+        stat = os.stat(path)
+        return {'min': int(data['open_time'].min()), 'max': int(data['open_time'].max()), 'rows': len(data),
+                'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+    @staticmethod
+    def _current_stats(files, path):
+        """
+        Stats of the file at path, None when they are missing or were taken from another version of the file
+        """
+        stats = files.get(os.path.basename(path))
+        if stats is None:
+            return None
+        stat = os.stat(path)
+        if (stats.get('size') != stat.st_size) or (stats.get('mtime') != stat.st_mtime_ns):
+            return None
+        return stats
+
+    @staticmethod
+    def _write_parquet(data, path):
+        # written next to the partition and then swapped in so a crash never leaves a half written file
+        tmp_path = temp_path(path)
+        data.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    def symbols(self):
+        if not os.path.exists(self.base_path):
+            return []
+        return sorted(s for s in os.listdir(self.base_path) if os.path.isdir(os.path.join(self.base_path, s)))
+
+    def partitions(self, symbol, interval, start=None, end=None):
+        """
+        (day, path) of the files which can hold candles opened between start and end, each day file comes before its
+        segments and the segments are in the order they were written
+        """
+        paths = glob.glob(os.path.join(self._series_path(symbol, interval), "*.parquet"))
+        paths = sorted(paths, key=lambda p: (os.path.basename(p)[:8], is_segment(p), p))
+        partitions = [(partition_to_day(os.path.basename(p)), p) for p in paths]
+        start, end = to_milliseconds(start), to_milliseconds(end)
+        if start is not None:
+            partitions = [(d, p) for d, p in partitions if d >= start // DAY_MILLISECONDS]
+        if end is not None:
+            partitions = [(d, p) for d, p in partitions if d <= end // DAY_MILLISECONDS]
+        return partitions
+
+    def exists(self, symbol, interval):
+        return len(self.partitions(symbol, interval)) > 0
+
+    def write(self, symbol, interval, data, update_meta=True):
+        """
+        Appends the candles as a new segment of each day they fall in, nothing already stored is read or rewritten.
+        Returns the stats of the written files, with update_meta=False the _meta.json is left to the caller through
+        update_meta so that several processes can write different days of a series.
+        """
+        if len(data) == 0:
+            return {}
+        data = pd.DataFrame(data)
+        if list(data.columns) != CANDLES_HEADER:
+            data = data[CANDLES_HEADER]
+        data = data.astype(CANDLES_HEADER_TYPES)
+        os.makedirs(self._series_path(symbol, interval), exist_ok=True)
+
+        files = {}
+        segment = time.time_ns()
+        for day, df_day in data.groupby(data['open_time'].values // DAY_MILLISECONDS):
+            df_day = df_day.sort_values(by='open_time').drop_duplicates(subset='open_time', keep='last')
+            path = self._partition_path(symbol, interval, day)
+            if os.path.exists(path):
+                path = self._partition_path(symbol, interval, day, segment)
+            self._write_parquet(df_day, path)
+            files[os.path.basename(path)] = self._file_stats(df_day, path)
+
+        if update_meta:
+            self.update_meta(symbol, interval, files)
+        return files
+
+    def update_meta(self, symbol, interval, files):
+        """
+        Adds the stats of written files to the _meta.json of the series and moves its last_open_time forward
+        """
+        if len(files) == 0:
+            return
+        meta = self._read_meta(symbol, interval)
+        meta.setdefault('files', {}).update(files)
+        last_open_time = max(f['max'] for f in files.values())
+        if meta.get('last_open_time', last_open_time) > last_open_time:
+            last_open_time = meta['last_open_time']
+        meta['last_open_time'] = last_open_time
+        self._write_meta(symbol, interval, meta)
+
+    def compact(self, symbol, interval):
+        """
+        Merges the segments of every day into its day file, meant to be run on a schedule rather than on every update
+        """
+        partitions = self.partitions(symbol, interval)
+        days = sorted(set(d for d, p in partitions if is_segment(p)))
+        meta = self._read_meta(symbol, interval)
+        files = meta.setdefault('files', {})
+        for day in days:
+            paths = [p for d, p in partitions if d == day]
+            data = pd.concat([pd.read_parquet(p) for p in paths], ignore_index=True)
+            data = data.sort_values(by='open_time', kind='stable').drop_duplicates(subset='open_time', keep='last')
+            day_path = self._partition_path(symbol, interval, day)
+            self._write_parquet(data, day_path)
+            files[os.path.basename(day_path)] = self._file_stats(data, day_path)
+            for path in paths:
+                if is_segment(path):
+                    os.remove(path)
+                    files.pop(os.path.basename(path), None)
+        if len(days) > 0:
+            self._write_meta(symbol, interval, meta)
+        return len(days)
+
+    def refresh_stats(self, symbol, interval):
+        """
+        Rebuilds the stats of the files of a series from their open_time column, for series written before the
+        stats were kept
+        """
+        meta = self._read_meta(symbol, interval)
+        meta['files'] = {os.path.basename(p): self._file_stats(pd.read_parquet(p, columns=['open_time']), p)
+                         for _, p in self.partitions(symbol, interval)}
+        self._write_meta(symbol, interval, meta)
+        return meta['files']
+
+    def stats(self, symbol, interval):
+        """
+        Rows and first and last open_time of the series from the stats of its files, only the files without current
+        stats are read
+        """
+        files = self._read_meta(symbol, interval).get('files', {})
+        known = []
+        for _, p in self.partitions(symbol, interval):
+            stats = self._current_stats(files, p)
+            known.append(self._file_stats(pd.read_parquet(p, columns=['open_time']), p) if stats is None else stats)
+        if len(known) == 0:
+            return {'min': None, 'max': None, 'rows': 0}
+        # rows counts the duplicates between a day and its segments until they are compacted
+        return {'min': min(f['min'] for f in known), 'max': max(f['max'] for f in known),
+                'rows': sum(f['rows'] for f in known)}
+
+    def compact_all(self):
+        for symbol in self.symbols():
+            for interval in sorted(os.listdir(os.path.join(self.base_path, symbol))):
+                compacted = self.compact(symbol, interval)
+                if compacted > 0:
+                    print(f"{symbol} {interval}: compacted {compacted} days")
+
+    def read(self, symbol, interval, start=None, end=None, columns=None):
+        """
+        Candles with start <= open_time <= end, only the partitions of the range and the requested columns are read
+        """
+        start, end = to_milliseconds(start), to_milliseconds(end)
+        read_columns = None if columns is None else list(dict.fromkeys(['open_time'] + list(columns)))
+        partitions = self.partitions(symbol, interval, start, end)
+        files = self._read_meta(symbol, interval).get('files', {}) if (start is not None) or (end is not None) else {}
+        stats = [self._current_stats(files, p) for _, p in partitions]
+        # files whose open times are all outside the range are skipped
+        keep = [(f is None) or (((start is None) or (f['max'] >= start)) and ((end is None) or (f['min'] <= end)))
+                for f in stats]
+        partitions = [p for p, k in zip(partitions, keep) if k]
+        stats = [f for f, k in zip(stats, keep) if k]
+        frames = [pd.read_parquet(p, columns=read_columns) for _, p in partitions]
+        if len(frames) == 0:
+            return empty_candles(columns)
+
+        data = pd.concat(frames, ignore_index=True)
+        if any(is_segment(p) for _, p in partitions):
+            data = data.sort_values(by='open_time', kind='stable').drop_duplicates(subset='open_time', keep='last')
+        # the mask is only needed when a file runs over the range
+        if (start is not None) and any((f is None) or (f['min'] < start) for f in stats):
+            data = data[data['open_time'].values >= start]
+        if (end is not None) and any((f is None) or (f['max'] > end) for f in stats):
+            data = data[data['open_time'].values <= end]
+        data = data.reset_index(drop=True)
+        return data if columns is None else data[list(columns)]
+
+    def last_open_time(self, symbol, interval):
+        meta = self._read_meta(symbol, interval)
+        if 'last_open_time' in meta:
+            return meta['last_open_time']
+
+        partitions = self.partitions(symbol, interval)
+        if len(partitions) == 0:
+            return None
+        last_day = partitions[-1][0]
+        return int(max(pd.read_parquet(p, columns=['open_time'])['open_time'].max()
+                       for d, p in partitions if d == last_day))
+
+
+if __name__ == "__main__":
+    CandleStore(r"D:\crypto\data\store").compact_all()
@@ -45,3 +45,6 @@ CANDLES_HEADER_TYPES_AN = {0: np.int64,
                            9: np.float64,
                            10: np.float64,
                            11: np.float64}
+
+# little endian record of one candle, 96 bytes
+CANDLES_DTYPE = np.dtype([(k, np.dtype(v).newbyteorder('<')) for k, v in CANDLES_HEADER_TYPES.items()])
@@ -0,0 +1,235 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_analysis.panel import MarketPanel
+
+WINDOW_BARS = 24 * 60
+STEP_BARS = 60
+BLOCK_SYMBOLS = 512
+CORRELATION_THRESHOLD = 0.7
+# share of the window a symbol needs to trade in to be part of a snapshot
+MIN_COVERAGE = 0.8
+SNAPSHOTS_INDEX = "snapshots.json"
+
+
+def log_returns(close):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.diff(np.log(close), axis=0)
+
+
+def valid_columns(returns, min_periods):
+    return np.flatnonzero(np.isfinite(returns).sum(axis=0) >= min_periods)
+
+
+def correlation_blocks(returns, min_periods=2, block=BLOCK_SYMBOLS):
+    """
+    (row offset, column offset, correlations) of the blocks of the upper triangle, only block x block correlations
+    are held at once. Each pair is correlated over the rows both have, like DataFrame.corr, from sums of matrix
+    products, the pairs with fewer than min_periods common rows are nan.
+    """
+    valid = np.isfinite(returns)
+    centered = np.where(valid, returns, 0.)
+    centered -= centered.sum(axis=0) / np.maximum(valid.sum(axis=0), 1)
+    centered[~valid] = 0.
+    complete = valid.all()
+    mask = valid.astype(np.float64)
+    squared = centered ** 2
+    n = returns.shape[1]
+    for i in range(0, n, block):
+        for j in range(i, n, block):
+            x, y = centered[:, i:i + block], centered[:, j:j + block]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                if complete:
+                    norms = np.sqrt(squared[:, i:i + block].sum(axis=0))[:, None] * \
+                            np.sqrt(squared[:, j:j + block].sum(axis=0))[None, :]
+                    correlations = (x.T @ y) / norms
+                    count = len(returns)
+                else:
+                    mask_x, mask_y = mask[:, i:i + block], mask[:, j:j + block]
+                    count = mask_x.T @ mask_y
+                    sum_x, sum_y = x.T @ mask_y, mask_x.T @ y
+                    covariance = x.T @ y - sum_x * sum_y / count
+                    variance_x = squared[:, i:i + block].T @ mask_y - sum_x ** 2 / count
+                    variance_y = mask_x.T @ squared[:, j:j + block] - sum_y ** 2 / count
+                    correlations = covariance / np.sqrt(variance_x * variance_y)
+            correlations[~np.isfinite(correlations) | (count < min_periods)] = np.nan
+            yield i, j, correlations
+
+
+def threshold_links(returns, threshold=CORRELATION_THRESHOLD, min_periods=2, block=BLOCK_SYMBOLS):
+    """
+    (source, target, correlation) arrays of the pairs with |correlation| >= threshold
+    """
+    sources, targets, values = [], [], []
+    for i, j, correlations in correlation_blocks(returns, min_periods, block):
+        with np.errstate(invalid='ignore'):
+            rows, columns = np.nonzero(np.abs(correlations) >= threshold)
+        keep = (rows + i) < (columns + j)
+        sources.append(rows[keep] + i)
+        targets.append(columns[keep] + j)
+        values.append(correlations[rows[keep], columns[keep]])
+    if len(sources) == 0:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+    return np.concatenate(sources), np.concatenate(targets), np.concatenate(values)
+
+
+def minimum_spanning_tree(returns, min_periods=2, block=BLOCK_SYMBOLS):
+    """
+    Mantegna's tree: Prim's algorithm on the distances sqrt(2 (1 - correlation)), one vector update per node.
+    Only the current window's matrix is held, as float32.
+    """
+    n = returns.shape[1]
+    if n < 2:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+    correlations = np.empty((n, n), dtype=np.float32)
+    for i, j, values in correlation_blocks(returns, min_periods, block):
+        correlations[i:i + values.shape[0], j:j + values.shape[1]] = values
+        correlations[j:j + values.shape[1], i:i + values.shape[0]] = values.T
+    distances = np.sqrt(np.clip(2 * (1 - correlations), 0, None))
+    # pairs without enough common rows are only joined when nothing else is left
+    distances[np.isnan(distances)] = np.float32(np.finfo(np.float32).max)
+
+    in_tree = np.zeros(n, dtype=bool)
+    in_tree[0] = True
+    best = distances[0].copy()
+    parent = np.zeros(n, dtype=np.int64)
+    sources, targets = [], []
+    for _ in range(n - 1):
+        candidates = np.where(in_tree, np.inf, best)
+        node = int(np.argmin(candidates))
+        in_tree[node] = True
+        sources.append(parent[node])
+        targets.append(node)
+        closer = distances[node] < best
+        best[closer] = distances[node][closer]
+        parent[closer] = node
+    sources, targets = np.array(sources), np.array(targets)
+    return sources, targets, correlations[sources, targets].astype(np.float64)
+
+
+def components(n, sources, targets):
+    """
+    Connected component of every node, numbered from 1 by decreasing size like the groups of the D3 view
+    """
+    parent = np.arange(n)
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for source, target in zip(sources, targets):
+        root_source, root_target = find(source), find(target)
+        if root_source != root_target:
+            parent[root_source] = root_target
+    roots = np.array([find(node) for node in range(n)], dtype=np.int64)
+    labels, inverse, counts = np.unique(roots, return_inverse=True, return_counts=True)
+    rank = np.empty(len(labels), dtype=np.int64)
+    rank[np.argsort(-counts, kind='stable')] = np.arange(1, len(labels) + 1)
+    return rank[inverse]
+
+
+def to_graph(symbols, sources, targets, values, decimals=4):
+    """
+    The {"nodes": [{"id", "group"}], "links": [{"source", "target", "value"}]} layout of crypto_market.json
+    """
+    groups = components(len(symbols), sources, targets)
+    return {'nodes': [{'id': s, 'group': int(g)} for s, g in zip(symbols, groups)],
+            'links': [{'source': symbols[s], 'target': symbols[t], 'value': round(float(v), decimals)}
+                      for s, t, v in zip(sources, targets, values)]}
+
+
+class CorrelationNetwork:
+    """
+    Rolling return correlation networks of the symbols of a MarketPanel.
+
+    Every step_bars a snapshot is built from the log returns of the last window_bars bars, pruned to the links above
+    threshold or to the minimum spanning tree, and written to {out_path}/{yyyymmddHHMM}.json with the list of
+    snapshots in snapshots.json. Candles are read one panel chunk at a time and only the window is kept, snapshots
+    already written are skipped so that a run can be resumed or extended.
+    """
+
+    def __init__(self, panel, out_path, window_bars=WINDOW_BARS, step_bars=STEP_BARS, method='threshold',
+                 threshold=CORRELATION_THRESHOLD, min_coverage=MIN_COVERAGE, block=BLOCK_SYMBOLS):
+        if method not in ('threshold', 'mst'):
+            raise ValueError("method should be threshold or mst")
+        self.panel = panel
+        self.out_path = out_path
+        self.window_bars = window_bars
+        self.step_bars = step_bars
+        self.method = method
+        self.threshold = threshold
+        self.min_periods = max(2, int(min_coverage * window_bars))
+        self.block = block
+        self.index_path = os.path.join(out_path, SNAPSHOTS_INDEX)
+        os.makedirs(out_path, exist_ok=True)
+
+    def snapshot(self, close):
+        """
+        Graph of a window of close prices, (window_bars + 1) x symbols
+        """
+        returns = log_returns(close)
+        kept = valid_columns(returns, self.min_periods)
+        returns = returns[:, kept]
+        if self.method == 'mst':
+            sources, targets, values = minimum_spanning_tree(returns, self.min_periods, self.block)
+        else:
+            sources, targets, values = threshold_links(returns, self.threshold, self.min_periods, self.block)
+        return to_graph([self.panel.symbols[k] for k in kept], sources, targets, values)
+
+    def _read_index(self):
+        if not os.path.exists(self.index_path):
+            return []
+        with open(self.index_path) as handle:
+            return json.load(handle)
+
+    def _write(self, name, graph, index):
+        path = os.path.join(self.out_path, name)
+        with open(path + ".tmp", "w") as handle:
+            json.dump(graph, handle)
+        os.replace(path + ".tmp", path)
+        index.append(name)
+        with open(self.index_path + ".tmp", "w") as handle:
+            json.dump(index, handle)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def run(self, start=None, end=None, chunk_days=1):
+        """
+        Writes the snapshots of the windows ending between start and end, returns the names of the new ones
+        """
+        index = self._read_index()
+        done = set(index)
+        written = []
+        close = np.empty((0, len(self.panel.symbols)))
+        open_times = np.empty(0, dtype=np.int64)
+        # bars seen before the buffer, a window ends on bar window_bars and every step_bars after it
+        offset = 0
+        for chunk in self.panel.iter_chunks(start, end, chunk_days, fields=['close']):
+            close = np.concatenate([close, chunk['close']])
+            open_times = np.concatenate([open_times, chunk.open_times])
+            first = offset + len(close) - len(chunk.open_times)
+            first = max(first, self.window_bars)
+            first += (-(first - self.window_bars)) % self.step_bars
+            for window_end in range(first - offset, len(close), self.step_bars):
+                name = pd.to_datetime(open_times[window_end], unit='ms').strftime("%Y%m%d%H%M") + ".json"
+                if name not in done:
+                    self._write(name, self.snapshot(close[window_end - self.window_bars:window_end + 1]), index)
+                    done.add(name)
+                    written.append(name)
+                    print(f"{name}: {len(index)} snapshots")
+            kept = min(len(close), self.window_bars + 1)
+            offset += len(close) - kept
+            close, open_times = close[len(close) - kept:], open_times[len(open_times) - kept:]
+        return written
+
+
+if __name__ == "__main__":
+    from data_analysis.candle_store import CandleStore
+
+    network = CorrelationNetwork(MarketPanel(CandleStore(r"G:\crypto\data\store"), interval='1m'),
+                                 r"G:\crypto\data\correlation_network", method='mst')
+    network.run('01/01/2023', '08/01/2023')
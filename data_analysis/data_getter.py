@@ -1,4 +1,5 @@
 import concurrent.futures
+import datetime
 import glob
 import json
 import os
@@ -6,14 +7,19 @@ import pickle
 import threading
 import time
 import traceback
-from urllib.parse import quote_plus
+from urllib.parse import quote_plus, parse_qsl
 
 import numpy as np
 import pandas as pd
-import requests
 
-from constants import VALID_INTERVALS, VALID_INTERVALS_TO_TIME, CANDLES_HEADER, CANDLES_HEADER_TYPES, \
-    CANDLES_HEADER_TYPES_AN
+from data_analysis.constants import VALID_INTERVALS, VALID_INTERVALS_TO_TIME, CANDLES_HEADER, CANDLES_HEADER_TYPES
+from data_analysis.gaps import find_gaps, gap_windows
+from data_analysis.http_session import BACKOFF_FACTOR, RETRY_STATUSES, get_session
+from data_analysis.kline_decoder import decode_klines
+from data_analysis.pipeline import CsvSink, DateCsvSink, StoreSink, batch_frames, drop_seen, fetch_pages, \
+    parse_pages, run_pipeline
+from data_analysis.rate_limiter import RateLimiter, get_rate_limiter, set_rate_limiter
+from data_analysis.resampling import derive_store_intervals, interval_close_times, interval_open_times
 
 BASE = "https://api.binance.com"
 API_PATHS = {"TIME": BASE + "/api/v3/time",
@@ -42,24 +48,99 @@ INTERVAL_TO_BUCKETS = {"1m": 6,
                        "3d": 10,
                        "1w": 10,
                        "1M": 10}
+# refer to https://binance-docs.github.io/apidocs/spot/en/#market-data-endpoints
+REQUEST_WEIGHTS = {"TIME": 1,
+                   "DEPTH": 1,
+                   "EXCHANGE_INFO": 10,
+                   "RECENT_TRADES": 1,
+                   "HISTORICAL_TRADES": 5,
+                   "AGGREGATE_TRADES": 1,
+                   "CANDLES": 1,
+                   "AVG_PRICE": 1,
+                   "24H": 1,
+                   "PRICE": 1,
+                   "ORDER_BOOK": 1}
+ALL_SYMBOLS_REQUEST_WEIGHTS = {"24H": 40,
+                               "PRICE": 2,
+                               "ORDER_BOOK": 2}
+PRICE_TYPES = {'price': np.float64}
+BOOK_TICKER_TYPES = {'bidPrice': np.float64, 'bidQty': np.float64, 'askPrice': np.float64, 'askQty': np.float64}
+AVG_PRICE_TYPES = {'mins': np.int64, 'price': np.float64}
+TICKER_24H_TYPES = {c: np.float64 for c in ['priceChange', 'priceChangePercent', 'weightedAvgPrice', 'prevClosePrice',
+                                            'lastPrice', 'lastQty', 'bidPrice', 'bidQty', 'askPrice', 'askQty',
+                                            'openPrice', 'highPrice', 'lowPrice', 'volume', 'quoteVolume']}
+TICKER_24H_TYPES.update({c: np.int64 for c in ['openTime', 'closeTime', 'firstId', 'lastId', 'count']})
+# weight of the 24H ticker of up to that many symbols in the symbols=[...] form
+SYMBOLS_24H_WEIGHTS = {20: 1, 100: 20}
+# above this many symbols one request for the whole market is filtered locally instead
+MAX_BATCH_SYMBOLS = 100
+DEPTH_LIMIT_TO_WEIGHT = {5: 1, 10: 1, 20: 1, 50: 1, 100: 1, 500: 5, 1000: 10, 5000: 50}
 START_HIST = '31/12/2016'
 THREADS = 10
-BUFFER = 4
-REQUESTS_PER_MINUTE = 1200
+MAX_RETRIES = 5
+# pages kept in memory before they are written to the store
+FLUSH_PAGES = 100
+# milliseconds a range has to be closed for before its response is cached for good, covers local clock drift
+CLOSED_RANGE_MARGIN = 60 * 1000
 
 
-# #TODO get them dynamically from api
 # TODO modify all print into logs
-# request
-# REQUEST_WEIGHT =
+
+
+def get_request_weight(request_type, params=None):
+    params = {} if params is None else params
+    if request_type == "DEPTH":
+        return DEPTH_LIMIT_TO_WEIGHT[int(params.get("limit", 100))]
+    if ("symbols" in params) and (request_type == "24H"):
+        n_symbols = len(json.loads(params["symbols"]))
+        return next((w for n, w in SYMBOLS_24H_WEIGHTS.items() if n_symbols <= n), ALL_SYMBOLS_REQUEST_WEIGHTS["24H"])
+    if ("symbol" not in params) and (request_type in ALL_SYMBOLS_REQUEST_WEIGHTS):
+        return ALL_SYMBOLS_REQUEST_WEIGHTS[request_type]
+    return REQUEST_WEIGHTS[request_type]
+
+
+def send_request(url, params=None, weight=1, rate_limiter=None, session=None):
+    """
+    Waits for the rate limiter to admit the request, retries after the backoff when the limit was hit (429) and gives
+    up straight away when the ip is banned (418). Server errors are retried with backoff, each attempt takes its own
+    reservation of the rate limiter as the server counts its weight.
+    """
+    rate_limiter = get_rate_limiter() if rate_limiter is None else rate_limiter
+    session = get_session(THREADS) if session is None else session
+    for attempt in range(MAX_RETRIES):
+        rate_limiter.acquire(weight)
+        try:
+            req = session.get(url, params=params)
+        except Exception:
+            rate_limiter.release(weight)
+            raise
+        rate_limiter.release(weight, req.headers, req.status_code)
+        if req.status_code == 429:
+            continue
+        if req.status_code in RETRY_STATUSES:
+            time.sleep(BACKOFF_FACTOR * 2 ** attempt)
+            continue
+        if not req.ok:
+            raise BinanceRequestException(req.text, req.status_code)
+        return req
+    if req.status_code in RETRY_STATUSES:
+        raise BinanceRequestException(req.text, req.status_code)
+    raise BinanceRequestException(f"Rate limit still exceeded after {MAX_RETRIES} retries", 429)
+
 
 class DataGetterSymbol:
 
-    def __init__(self, symbol: str, pandas: bool = False, base_save_path=None):
+    def __init__(self, symbol: str, pandas: bool = False, base_save_path=None, rate_limiter=None, session=None,
+                 store=None, manifest=None, cache=None):
         self.symbol = symbol
         self.api_paths = API_PATHS
         self.pandas = pandas
         self.base_save_path = base_save_path
+        self.store = store
+        self.manifest = manifest
+        self.cache = cache
+        self.rate_limiter = get_rate_limiter() if rate_limiter is None else rate_limiter
+        self.session = get_session(THREADS) if session is None else session
         self.used_weight = 0
 
     def _handle_default_options(self, data, name_file=None):
@@ -88,17 +169,18 @@ class DataGetterSymbol:
         url = "{}?{}".format(endpoint, query)
         return url
 
-    def _handle_request(self, request_type, params=None):
+    def _send_request(self, request_type, params=None):
         if request_type not in self.api_paths:
             raise ValueError("Unknown Request Type")
         endpoint = self.api_paths[request_type]
-        req = requests.get(endpoint, params=params)
-        # TODO add something to use all the extra information that requests returns
-        if not req.ok:
-            # TODO Change to something different than ValueError
-            raise ValueError(req.text, req.status_code)
+        req = send_request(endpoint, params=params, weight=get_request_weight(request_type, params),
+                           rate_limiter=self.rate_limiter, session=self.session)
         # X-MBX-USED-WEIGHT-(intervalNum)(intervalLetter)
-        self.used_weight += int(req.headers['x-mbx-used-weight'])
+        self.used_weight += int(req.headers.get('x-mbx-used-weight', 0))
+        return req
+
+    def _handle_request(self, request_type, params=None):
+        req = self._send_request(request_type, params)
         res = json.loads(req.content)
         return res
 
@@ -181,9 +263,11 @@ class DataGetterSymbol:
         file_name = f"{self.symbol}_aggTrades_{from_id}" if save else None
         raise self._handle_default_options(res, file_name)
 
-    def get_candles(self, interval, start_time=None, end_time=None, limit=500, save=True, return_url=False):
+    def get_candles(self, interval, start_time=None, end_time=None, limit=500, save=True, return_url=False,
+                    decode=False):
         """
         refer to https://binance-docs.github.io/apidocs/spot/en/#kline-candlestick-data
+        with decode the response bytes are parsed straight into a typed CANDLES_HEADER DataFrame and nothing is saved
         """
         if interval not in VALID_INTERVALS:
             raise ValueError("Invalid Interval")
@@ -195,7 +279,15 @@ class DataGetterSymbol:
         params = {k: v for k, v in params.items() if v is not None}
         if return_url:
             return self._get_url("CANDLES", params=params)
-        res = self._handle_request("CANDLES", params=params)
+        if self.cache is not None:
+            content = self._get_cached_candles(interval, params)
+            if decode:
+                return decode_klines(content)
+            res = json.loads(content)
+        elif decode:
+            return decode_klines(self._send_request("CANDLES", params=params).content)
+        else:
+            res = self._handle_request("CANDLES", params=params)
         if (start_time is not None) and (end_time is not None):
             file_name = f"{self.symbol}_candles_{interval}_{start_time}_{end_time}"
         else:
@@ -205,6 +297,23 @@ class DataGetterSymbol:
 
         return self._handle_default_options(res, file_name)
 
+    def _get_cached_candles(self, interval, params):
+        """
+        Raw klines response through the response cache, keyed by the url get_candles(return_url=True) builds. A range
+        is closed, and cached for good, when the last candle it can hold closed before now.
+        """
+        url = self._get_url("CANDLES", params=params)
+        content = self.cache.get(url)
+        if content is None:
+            content = self._send_request("CANDLES", params=params).content
+            closed = False
+            if "endTime" in params:
+                # close of the candle endTime falls in, calendar aware for 1M
+                last_open_time = interval_open_times([int(params["endTime"])], interval)
+                closed = interval_close_times(last_open_time, interval)[0] < time.time() * 1000 - CLOSED_RANGE_MARGIN
+            self.cache.put(url, content, closed)
+        return content
+
     def get_avg_price(self, save=True):
         """
         refer to https://binance-docs.github.io/apidocs/spot/en/#current-average-price
@@ -245,20 +354,64 @@ class DataGetterSymbol:
 
         return self._handle_default_options(res, file_name)
 
-    def get_historical_candles(self, start_date, interval, end_date=None, update=False, partition_by_date=False):
+    @staticmethod
+    def _read_last_open_time(file_name):
+        # the candles are sorted, so only the last line of the file is read
+        with open(file_name, 'rb') as handle:
+            handle.seek(0, os.SEEK_END)
+            position = handle.tell()
+            block = b""
+            while (position > 0) and (block.rstrip(b"\r\n").count(b"\n") == 0):
+                step = min(4096, position)
+                position -= step
+                handle.seek(position)
+                block = handle.read(step) + block
+        last_line = block.rstrip(b"\r\n").split(b"\n")[-1]
+        try:
+            return int(float(last_line.split(b",")[0]))
+        except ValueError:
+            # only the header is there
+            return None
+
+    def get_historical_candles(self, start_date, interval, end_date=None, update=False, partition_by_date=False,
+                               stream=False):
+        """
+        With stream the pages go through the bounded pipeline of _stream_historical_candles instead of being held in
+        memory until the download is over
+        """
         global THREADS
 
+        if (self.manifest is not None) and (self.store is None):
+            raise ValueError("the download manifest needs a store to flush the candles to")
+
         data = []
+        pending_windows = []
         empty_requests = 0
         exceptions = 0
         stop_execution = False
         lock = threading.Lock()
+        flush_lock = threading.Lock()
+
+        def flush():
+            # swaps the buffers out so the other threads keep downloading while the chunk is written
+            nonlocal data
+            nonlocal pending_windows
+            with lock:
+                pages, windows = data, pending_windows
+                data, pending_windows = [], []
+            with flush_lock:
+                pages = [page for page in pages if len(page) > 0]
+                if len(pages) > 0:
+                    chunk = pd.concat(pages, ignore_index=True)
+                    if last_open_time is not None:
+                        chunk = chunk[chunk['open_time'] > last_open_time]
+                    self.store.write(self.symbol, interval, chunk)
+                # only marked once their candles are on disk
+                if self.manifest is not None:
+                    self.manifest.mark_completed(self.symbol, interval, windows)
 
         def threaded_get_candles(time_range):
 
-            global THREADS
-            global REQUESTS_PER_MINUTE
-            global BUFFER
             nonlocal data
             nonlocal exceptions
             nonlocal empty_requests
@@ -272,9 +425,13 @@ class DataGetterSymbol:
 
             try:
                 temp = self.get_candles(interval, start_time=time_range[0], end_time=time_range[1], limit=1000,
-                                        save=False)
+                                        save=False, decode=True)
                 with lock:
                     data.append(temp)
+                    pending_windows.append((time_range[0], time_range[1], len(temp)))
+                    flush_now = (self.store is not None) and (len(data) >= FLUSH_PAGES)
+                if flush_now:
+                    flush()
             except Exception as err:
                 print(err)
                 # TODO implement better exception handling
@@ -288,8 +445,6 @@ class DataGetterSymbol:
                     with lock:
                         stop_execution = True
                         raise
-            finally:
-                time.sleep(((THREADS + BUFFER) * 60) / REQUESTS_PER_MINUTE)
 
             if len(temp) == 0:
                 with lock:
@@ -299,25 +454,41 @@ class DataGetterSymbol:
                     with lock:
                         stop_execution = True
 
-        file_name = f"{self.symbol}_{interval}.csv"
-        file_name = os.path.join(self.base_save_path, file_name)
+        if self.store is not None:
+            file_name = None
+            file_exists = self.store.exists(self.symbol, interval)
+        else:
+            file_name = f"{self.symbol}_{interval}.csv"
+            file_name = os.path.join(self.base_save_path, file_name)
+            file_exists = os.path.exists(file_name)
 
-        file_exists = os.path.exists(file_name)
+        # a download which was interrupted is picked up again even if part of it is already stored
+        resuming = (self.manifest is not None) and self.manifest.is_unfinished(self.symbol, interval)
 
         end_time = self.get_server_time() if end_date is None else int(
             (pd.to_datetime(end_date, dayfirst=True) + pd.DateOffset(days=1)).to_datetime64().view('<i8') / 10e5) - 1
         interval_milliseconds = VALID_INTERVALS_TO_TIME[interval]
 
-        if file_exists and (not update):
+        if file_exists and (not update) and (not resuming):
             return None
         else:
-            if not file_exists:
+            # only what comes after the last stored candle is downloaded and appended
+            if (not file_exists) or resuming:
+                last_open_time = None
+            elif self.store is not None:
+                last_open_time = self.store.last_open_time(self.symbol, interval)
+            else:
+                last_open_time = self._read_last_open_time(file_name)
+
+            if last_open_time is None:
                 start_time = int(pd.to_datetime(start_date, dayfirst=True).to_datetime64().view('<i8') / 10e5)
             else:
-                data = pd.read_csv(file_name, header=None, skiprows=1)
-                data = data.astype(CANDLES_HEADER_TYPES_AN)
-                start_time = int(data.iloc[-1, 0] + interval_milliseconds)
-                data = [data]
+                start_time = int(last_open_time + interval_milliseconds)
+
+            completed_windows = set()
+            if self.manifest is not None:
+                start_time = self.manifest.start(self.symbol, interval, start_time)
+                completed_windows = self.manifest.completed_windows(self.symbol, interval)
 
             range_m = np.arange(start_time, end_time, interval_milliseconds * 1000)
 
@@ -332,23 +503,53 @@ class DataGetterSymbol:
                 range_start = np.append(range_start, range_m[-1])
                 range_end = np.append(range_end, end_time)
 
-            start_end_range = zip(range_start[::-1], range_end[::-1])
+            start_end_range = [(int(st), int(nd)) for st, nd in zip(range_start[::-1], range_end[::-1])
+                               if (int(st), int(nd)) not in completed_windows]
+            if len(completed_windows) > 0:
+                print(f"Skipping {len(completed_windows)} windows which were already downloaded")
+
+            if stream:
+                if self.store is not None:
+                    sink = StoreSink(self.store, self.symbol, interval)
+                elif partition_by_date:
+                    sink = DateCsvSink(self.base_save_path, self.symbol)
+                else:
+                    sink = CsvSink(file_name)
+                self._stream_historical_candles(interval, start_end_range[::-1], sink, last_open_time)
+                return None
 
             started_threading = time.time()
             executor = concurrent.futures.ThreadPoolExecutor(THREADS)
-            executor.map(threaded_get_candles, start_end_range)
-            executor.shutdown(wait=True)
+            try:
+                executor.map(threaded_get_candles, start_end_range)
+                executor.shutdown(wait=True)
+            except KeyboardInterrupt:
+                # keep what was downloaded so far
+                stop_execution = True
+                executor.shutdown(wait=True)
+                if self.store is not None:
+                    flush()
+                raise
             print(f"Threading took {time.time() - started_threading} seconds")
 
+            if self.store is not None:
+                flush()
+                if (self.manifest is not None) and (exceptions == 0):
+                    self.manifest.finish(self.symbol, interval)
+                return None
+
             data = pd.concat(data, ignore_index=True)
             if len(data) == 0:
                 return None
-            data = data.sort_values(by=0)
-            data.columns = CANDLES_HEADER
+            data = data.sort_values(by=CANDLES_HEADER[0])
             data = data.drop_duplicates(subset=CANDLES_HEADER[0])
-            data = data.astype(CANDLES_HEADER_TYPES)
+            if last_open_time is not None:
+                data = data[data['open_time'] > last_open_time]
             if not partition_by_date:
-                data.to_csv(file_name, index=False)
+                if file_exists:
+                    data.to_csv(file_name, index=False, mode='a', header=False)
+                else:
+                    data.to_csv(file_name, index=False)
             else:
                 data['date'] = pd.to_datetime(data['open_time'].values * 1000000).date
                 data['sym'] = self.symbol
@@ -364,6 +565,53 @@ class DataGetterSymbol:
                     else:
                         df_date.to_csv(date_path, index=False, mode='a', header=False)
 
+    def _stream_historical_candles(self, interval, windows, sink, last_open_time=None):
+        """
+        Downloads the windows in open_time order through fetch -> parse -> drop seen -> batch -> sink, peak memory
+        depends on THREADS and CHUNK_ROWS rather than on the length of the history
+        """
+        global THREADS
+
+        exceptions = 0
+        lock = threading.Lock()
+
+        def fetch(start_time, end_time):
+            nonlocal exceptions
+            try:
+                return self.get_candles(interval, start_time=start_time, end_time=end_time, limit=1000, save=False,
+                                        decode=True)
+            except Exception as err:
+                print(f"error for {start_time} and {end_time}: {err}")
+                with lock:
+                    exceptions += 1
+                    if exceptions >= 10:
+                        raise
+                return None
+
+        if len(windows) == 0:
+            return 0
+        if last_open_time is None:
+            # no requests for the windows before the symbol was listed
+            first = self.get_candles(interval, start_time=windows[0][0], end_time=windows[-1][1], limit=1, save=False,
+                                     decode=True)
+            if len(first) == 0:
+                print("No data")
+                if self.manifest is not None:
+                    self.manifest.finish(self.symbol, interval)
+                return 0
+            windows = [w for w in windows if w[1] >= int(first['open_time'].iloc[0])]
+
+        started_threading = time.time()
+        with concurrent.futures.ThreadPoolExecutor(THREADS) as executor:
+            pages = fetch_pages(fetch, windows, executor, THREADS * 2)
+            chunks = batch_frames(drop_seen(parse_pages(pages), last_open_time))
+            written = run_pipeline(chunks, sink, self.manifest, self.symbol, interval)
+        print(f"Streaming {written} candles took {time.time() - started_threading} seconds")
+
+        if (self.manifest is not None) and (exceptions == 0):
+            self.manifest.finish(self.symbol, interval)
+        return written
+
     def get_urls_for_historical_candles(self, start_date, end_date, interval="1m"):
 
         start_time = int(pd.to_datetime(start_date, dayfirst=True).to_datetime64().view('<i8') / 10e5)
@@ -391,7 +639,16 @@ class DataGetterSymbol:
 
         return urls
 
-    def get_all_historical_candles(self, start_date):
+    def get_all_historical_candles(self, start_date, derive=False):
+        if derive:
+            if self.store is None:
+                raise ValueError("deriving the intervals needs a store")
+            # only the 1m candles are downloaded, every other interval is built from them
+            self.get_historical_candles(start_date, VALID_INTERVALS[0], update=True)
+            derive_store_intervals(self.store, self.symbol, VALID_INTERVALS[1:], VALID_INTERVALS[0])
+            print("derived all intervals")
+            return None
+
         for interval in VALID_INTERVALS[::-1]:
             self.get_historical_candles(start_date, interval)
             print(f"gotten {interval}")
@@ -422,9 +679,6 @@ class DataGetterSymbol:
 
         def threaded_get_candles(time_range):
 
-            global THREADS
-            global REQUESTS_PER_MINUTE
-            global BUFFER
             nonlocal data
             nonlocal exceptions
             nonlocal empty_requests
@@ -437,7 +691,7 @@ class DataGetterSymbol:
             temp = pd.DataFrame()
             try:
                 temp = self.get_candles(interval, start_time=time_range[0], end_time=time_range[1], limit=1000,
-                                        save=False)
+                                        save=False, decode=True)
                 with lock:
                     data.append(temp)
             except Exception as err:
@@ -453,8 +707,6 @@ class DataGetterSymbol:
                     with lock:
                         stop_execution = True
                         raise
-            finally:
-                time.sleep(((THREADS + BUFFER) * 60) / REQUESTS_PER_MINUTE)
 
             if len(temp) == 0:
                 with lock:
@@ -472,45 +724,72 @@ class DataGetterSymbol:
         data = pd.concat(data)
         if len(data) == 0:
             return None
-        data = data.sort_values(by=0)
-
-        data.columns = CANDLES_HEADER
+        data = data.sort_values(by=CANDLES_HEADER[0])
 
         return data
 
+    def get_candles_for_windows(self, interval, windows):
+        """
+        Downloads every (start, end) window of at most 1000 candles through one thread pool
+        """
+
+        def get_window(window):
+            try:
+                return self.get_candles(interval, start_time=int(window[0]), end_time=int(window[1]), limit=1000,
+                                        save=False, decode=True)
+            except Exception as err:
+                print(err)
+                print(f"error for {window[0]} and {window[1]}")
+                return None
+
+        started_threading = time.time()
+        with concurrent.futures.ThreadPoolExecutor(THREADS) as executor:
+            pages = list(executor.map(get_window, windows))
+        print(f"Threading took {time.time() - started_threading} seconds")
+
+        pages = [page for page in pages if (page is not None) and (len(page) > 0)]
+        if len(pages) == 0:
+            return None
+        data = pd.concat(pages, ignore_index=True)
+        return data.sort_values(by='open_time').drop_duplicates(subset='open_time')
+
     def fill_candle_data_gaps(self, interval):
-        file_name = f"{self.symbol}_{interval}_*"
-        file = glob.glob(os.path.join(self.base_save_path, file_name))
-        if len(file) != 1:
-            # TODO make better error
-            raise ValueError(f"file is {file}")
+        if self.store is not None:
+            file = None
+            data = self.store.read(self.symbol, interval, columns=['open_time'])
+        else:
+            file_name = f"{self.symbol}_{interval}_*"
+            file = glob.glob(os.path.join(self.base_save_path, file_name))
+            if len(file) != 1:
+                # TODO make better error
+                raise ValueError(f"file is {file}")
 
-        data = pd.read_csv(file[0])
+            data = pd.read_csv(file[0], header=None, names=CANDLES_HEADER, dtype=CANDLES_HEADER_TYPES)
 
-        interval_milliseconds = VALID_INTERVALS_TO_TIME[interval]
-        diff = data.open_time.diff()
-        is_gap = diff.fillna(interval_milliseconds) > interval_milliseconds
-        gap_end = data.open_time[is_gap].values - 1
-        gap_start = (data.open_time.shift()[is_gap] + interval_milliseconds).values.astype(np.int64)
+        gap_start, gap_end = find_gaps(data['open_time'].values, interval)
         if len(gap_end) == 0:
             print("there are no gaps")
             return None
 
-        gap_data = []
-        for st, nd in zip(gap_start, gap_end):
-            gap_data += [self.get_candles_from_millisecond_range(st, nd, interval)]
-
-        gap_data = [x for x in gap_data if x is not None]
-        gap_data = [x for x in gap_data if len(x) > 1]
-        if len(gap_data) == 0:
+        # neighbouring gaps share requests and all of them go through a single thread pool
+        gaps = pd.DataFrame({'symbol': self.symbol, 'interval': interval, 'start': gap_start, 'end': gap_end})
+        windows = [(st, nd) for _, _, st, nd in gap_windows(gaps)]
+        gap_data = self.get_candles_for_windows(interval, windows)
+        if gap_data is None:
             print("no extra data was found")
             return None
 
-        new_data = [data] + gap_data
+        if self.store is not None:
+            # appended as new segments of the days with gaps, CandleStore.compact merges them later
+            self.store.write(self.symbol, interval, gap_data)
+            return None
+
+        new_data = [data, gap_data[CANDLES_HEADER].astype(CANDLES_HEADER_TYPES)]
         new_data = pd.concat(new_data)
-        new_data = new_data.sort_values(by='open_time')
+        # the windows also cover the stored candles between nearby gaps
+        new_data = new_data.sort_values(by='open_time').drop_duplicates(subset='open_time', keep='last')
 
-        new_data.to_csv(file[0], index=False)
+        new_data.to_csv(file[0], header=False, index=False)
 
 
 def get_param_from_url(url, param_name):
@@ -527,10 +806,6 @@ class ThreadedRequester:
     @classmethod
     def threaded_get_requests(cls, url):
 
-        global THREADS
-        global REQUESTS_PER_MINUTE
-        global BUFFER
-
         if cls.stop_execution:
             return None
 
@@ -555,14 +830,12 @@ class ThreadedRequester:
                 with cls.lock:
                     cls.stop_execution = True
                     raise
-        finally:
-            time.sleep(((THREADS + BUFFER) * 60) / REQUESTS_PER_MINUTE)
 
     @classmethod
     def get_url(cls, url):
-        req = requests.get(url)
-        if not req.ok:
-            raise ValueError(req.text, req.status_code)
+        endpoint, _, query = url.partition("?")
+        request_type = [k for k, v in API_PATHS.items() if v == endpoint][0]
+        req = send_request(url, weight=get_request_weight(request_type, dict(parse_qsl(query))))
         return pd.DataFrame(json.loads(req.content))
 
     @classmethod
@@ -579,11 +852,80 @@ class ThreadedRequester:
 
 class DataGetterSymbolList:
 
-    def __init__(self, symbols: str, pandas: bool = False, base_save_path=None):
+    def __init__(self, symbols: str, pandas: bool = False, base_save_path=None, rate_limiter=None, session=None,
+                 store=None, manifest=None, cache=None):
         self.symbols = symbols
         self.pandas = pandas
         self.base_save_path = base_save_path
-        self.symbols_data_getters = [DataGetterSymbol(symbol, pandas, base_save_path) for symbol in symbols]
+        self.rate_limiter = get_rate_limiter() if rate_limiter is None else rate_limiter
+        self.session = get_session(THREADS) if session is None else session
+        self.store = store
+        self.manifest = manifest
+        self.cache = cache
+        self.symbols_data_getters = [DataGetterSymbol(symbol, pandas, base_save_path, self.rate_limiter, self.session,
+                                                      store, manifest, cache) for symbol in symbols]
+
+    def _bulk_request(self, request_type):
+        """
+        One request for all the symbols, with the symbols=[...] form for short lists and for the whole market otherwise
+        """
+        symbols = list(self.symbols)
+        if len(symbols) <= MAX_BATCH_SYMBOLS:
+            params = {"symbols": json.dumps(symbols, separators=(',', ':'))}
+        else:
+            params = None
+        req = send_request(API_PATHS[request_type], params=params, weight=get_request_weight(request_type, params),
+                           rate_limiter=self.rate_limiter, session=self.session)
+        return json.loads(req.content)
+
+    def _handle_snapshot(self, data, types, name_file=None):
+        """
+        Symbol indexed table of the symbols of the list, typed and appended to {name_file}.csv with a snapshot_time
+        column so every snapshot of the market goes to the same file
+        """
+        data = pd.DataFrame(data)
+        data = data[data['symbol'].isin(self.symbols)]
+        data = data.astype({k: v for k, v in types.items() if k in data.columns})
+        data.insert(0, 'snapshot_time', int(time.time() * 1000))
+        data = data.set_index('symbol')
+        if (self.base_save_path is not None) and (name_file is not None):
+            file_name = os.path.join(self.base_save_path, name_file + ".csv")
+            exists = os.path.exists(file_name)
+            data.to_csv(file_name, mode='a' if exists else 'w', header=not exists)
+        return data
+
+    def get_prices(self, save=True):
+        """
+        refer to https://binance-docs.github.io/apidocs/spot/en/#symbol-price-ticker
+        """
+        return self._handle_snapshot(self._bulk_request("PRICE"), PRICE_TYPES, "price_snapshots" if save else None)
+
+    def get_order_books(self, save=True):
+        """
+        refer to https://binance-docs.github.io/apidocs/spot/en/#symbol-order-book-ticker
+        """
+        return self._handle_snapshot(self._bulk_request("ORDER_BOOK"), BOOK_TICKER_TYPES,
+                                     "orderBook_snapshots" if save else None)
+
+    def get_24h_stats(self, save=True):
+        """
+        refer to https://binance-docs.github.io/apidocs/spot/en/#24hr-ticker-price-change-statistics
+        """
+        return self._handle_snapshot(self._bulk_request("24H"), TICKER_24H_TYPES, "24h_snapshots" if save else None)
+
+    def get_avg_prices(self, save=True):
+        """
+        avgPrice has no form for several symbols, the requests share the session and thread pool and the results still
+        go to one table and one file
+        """
+
+        def get_avg_price(data_getter):
+            return dict(data_getter._handle_request("AVG_PRICE", params={"symbol": data_getter.symbol}),
+                        symbol=data_getter.symbol)
+
+        with concurrent.futures.ThreadPoolExecutor(THREADS) as executor:
+            data = list(executor.map(get_avg_price, self.symbols_data_getters))
+        return self._handle_snapshot(data, AVG_PRICE_TYPES, "avgPrice_snapshots" if save else None)
 
 
 class BinanceRequestException(Exception):
@@ -599,9 +941,11 @@ if __name__ == "__main__":
     date_range = pd.date_range(pd.to_datetime(date_to_start, dayfirst=True), datetime.date.today(), freq='1D').strftime(
         '%d/%m/%Y').tolist()
 
-    exchange_info = DataGetterSymbol("None", pandas=True, base_save_path=None).get_exchange_info(get_all=True,
-                                                                                                 save=False)
-    coins_to_get = exchange_info.loc[:, 'symbol']
+    from data_analysis.exchange_info import ExchangeInfoCache
+
+    exchange_info = ExchangeInfoCache(exchange_info_path).load()
+    set_rate_limiter(RateLimiter(exchange_info.rate_limits()))
+    coins_to_get = exchange_info.symbols(status=None)
 
     for coin in coins_to_get:
         print(f"{coin}: Started")
@@ -1,9 +1,11 @@
 import os
 
-import numpy as np
 import pandas as pd
 
-from data_analysis.constants import CANDLES_HEADER, VALID_INTERVALS, VALID_INTERVALS_TO_TIME
+from data_analysis.candle_binary import MappedCandles, binary_path
+from data_analysis.candle_index import read_csv_range
+from data_analysis.constants import CANDLES_HEADER, CANDLES_HEADER_TYPES, VALID_INTERVALS, VALID_INTERVALS_TO_TIME
+from data_analysis.resampling import compare_candles, resample_candles
 
 # import dask.dataframe as dd
 # from glob import glob
@@ -11,17 +13,31 @@ from data_analysis.constants import CANDLES_HEADER, VALID_INTERVALS, VALID_INTER
 DATA_PATH = r"C:\Users\salom\PycharmProjects\crypto\data\symbols"
 
 
-def ms_dt_parser(ms):
-    return pd.to_datetime(int(ms) * 10e5)
-
-
 class DataValidator:
 
-    def __init__(self, symbol, data_path):
+    def __init__(self, symbol, data_path, store=None, binary=False):
         self.symbol = symbol
         self.data_path = data_path
-
-    def validate_candles(self, interval_1, interval_2):
+        self.store = store
+        self.binary = binary
+
+    def _load_candles(self, interval, start=None, end=None):
+        if self.binary:
+            return MappedCandles(binary_path(self.data_path, self.symbol, interval)).to_frame(start, end)
+        if self.store is not None:
+            return self.store.read(self.symbol, interval, start, end)
+        # path = os.path.join(self.data_path, f"{self.symbol}_{interval}_*")
+        path = os.path.join(self.data_path, f"{self.symbol}_{interval}_2012_2021_inc.csv")
+        if (start is None) and (end is None):
+            return pd.read_csv(path, header=None, names=CANDLES_HEADER, dtype=CANDLES_HEADER_TYPES)
+        # only the blocks of the range are parsed through the sidecar index of the file
+        return read_csv_range(path, start, end)
+
+    def validate_candles(self, interval_1, interval_2, start=None, end=None):
+        """
+        Rebuilds the larger interval out of the smaller one and returns the report of the candles which do not match,
+        between start and end when they are given
+        """
         if interval_1 not in VALID_INTERVALS:
             raise ValueError('interval_1 is not a valid interval')
         if interval_2 not in VALID_INTERVALS:
@@ -32,39 +48,27 @@ class DataValidator:
         else:
             small_interval, large_interval = interval_2, interval_1
 
-        # path_small = os.path.join(self.data_path, f"{self.symbol}_{small_interval}_*")
-        # path_large = os.path.join(self.data_path, f"{self.symbol}_{large_interval}_*")
-
-        path_small = os.path.join(self.data_path, f"{self.symbol}_{small_interval}_2012_2021_inc.csv")
-        path_large = os.path.join(self.data_path, f"{self.symbol}_{large_interval}_2012_2021_inc.csv")
-
-        df_small = pd.read_csv(path_small, header=None, index_col=0, parse_dates=[0, 6], date_parser=ms_dt_parser)
-        df_small.columns = CANDLES_HEADER[1:]
-        df_large = pd.read_csv(path_large, header=None, index_col=0, parse_dates=[0, 6], date_parser=ms_dt_parser)
-        df_large.columns = CANDLES_HEADER[1:]
-
-        for start, end in zip(df_large.index[:-1], df_large.index[1:]):
-            to_replicate = df_large.loc[start]
-            sm_index = df_small.index
-            relevant_small_date = df_small.loc[(sm_index >= start) & (sm_index < end)]
-
-            assert to_replicate['open'] == relevant_small_date['open'].iloc[0]
-            assert to_replicate['high'] == relevant_small_date['high'].max()
-            assert to_replicate['low'] == relevant_small_date['low'].min()
-            assert to_replicate['close'] == relevant_small_date['close'].iloc[-1]
-            assert np.isclose(to_replicate['volume'], relevant_small_date['volume'].sum())
-            assert np.isclose(to_replicate['quote_asset_volume'], relevant_small_date['quote_asset_volume'].sum())
-            assert np.isclose(to_replicate['number_of_trades'], relevant_small_date['number_of_trades'].sum())
-            assert np.isclose(to_replicate['taker_buy_base_asset_volume'],
-                              relevant_small_date['taker_buy_base_asset_volume'].sum())
-            assert np.isclose(to_replicate['taker_buy_quote_asset_volume'],
-                              relevant_small_date['taker_buy_quote_asset_volume'].sum())
-
-        print("Everything is expected")
+        df_large = self._load_candles(large_interval, start, end)
+        if len(df_large) == 0:
+            print(f"no {large_interval} candles")
+            return compare_candles(df_large, df_large)
+        # starts with the first large candle so that it is rebuilt whole
+        df_small = self._load_candles(small_interval, int(df_large['open_time'].iloc[0]), end)
+
+        # each small candle goes to the last large candle opened before it, so the grouping follows the stored
+        # candles whatever their alignment
+        derived = resample_candles(df_small, large_interval, bins=df_large['open_time'].values)
+        # the last large candle can still be open
+        report = compare_candles(df_large.iloc[:-1], derived)
+
+        if len(report) == 0:
+            print("Everything is expected")
+        else:
+            print(f"{report['open_time'].nunique()} {large_interval} candles do not match")
 
-        return df_small, df_large
+        return report
 
 
 if __name__ == "__main__":
     validator = DataValidator("ETHUSDT", DATA_PATH)
-    small, large = validator.validate_candles("1d", "1w")
+    mismatches = validator.validate_candles("1d", "1w")
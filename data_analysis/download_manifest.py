@@ -0,0 +1,76 @@
+import os
+import sqlite3
+import threading
+import time
+
+MANIFEST_FILE = "_manifest.sqlite"
+
+
+class DownloadManifest:
+    """
+    SQLite record of the (symbol, interval, window) pages which are already on disk, so that an interrupted backfill
+    restarts where it stopped. A series stays unfinished until a download of it completed without errors.
+    """
+
+    def __init__(self, path):
+        if os.path.isdir(path):
+            path = os.path.join(path, MANIFEST_FILE)
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self.lock, self.connection:
+            # several processes can share the manifest
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS series (symbol TEXT, interval TEXT, "
+                                    "start_time INTEGER, finished INTEGER, updated_at REAL, "
+                                    "PRIMARY KEY (symbol, interval))")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS windows (symbol TEXT, interval TEXT, "
+                                    "window_start INTEGER, window_end INTEGER, rows INTEGER, completed_at REAL, "
+                                    "PRIMARY KEY (symbol, interval, window_start, window_end))")
+
+    def is_unfinished(self, symbol, interval):
+        with self.lock:
+            row = self.connection.execute("SELECT finished FROM series WHERE symbol = ? AND interval = ?",
+                                          (symbol, interval)).fetchone()
+        return (row is not None) and (row[0] == 0)
+
+    def start(self, symbol, interval, start_time):
+        """
+        Returns the start time the windows of the series have to be built from, the one of the unfinished download
+        if there is one so that the windows line up with the completed ones
+        """
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT start_time, finished FROM series WHERE symbol = ? AND interval = ?",
+                                          (symbol, interval)).fetchone()
+            if (row is not None) and (row[1] == 0):
+                return row[0]
+            self.connection.execute("DELETE FROM windows WHERE symbol = ? AND interval = ?", (symbol, interval))
+            self.connection.execute("INSERT OR REPLACE INTO series VALUES (?, ?, ?, 0, ?)",
+                                    (symbol, interval, int(start_time), time.time()))
+        return int(start_time)
+
+    def completed_windows(self, symbol, interval):
+        with self.lock:
+            rows = self.connection.execute("SELECT window_start, window_end FROM windows "
+                                           "WHERE symbol = ? AND interval = ?", (symbol, interval)).fetchall()
+        return set(rows)
+
+    def mark_completed(self, symbol, interval, windows):
+        """
+        windows are (window_start, window_end, rows), to be called once their candles are written
+        """
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO windows VALUES (?, ?, ?, ?, ?, ?)",
+                                        [(symbol, interval, int(st), int(nd), int(rows), now)
+                                         for st, nd, rows in windows])
+
+    def finish(self, symbol, interval):
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE series SET finished = 1, updated_at = ? WHERE symbol = ? AND interval = ?",
+                                    (time.time(), symbol, interval))
+            self.connection.execute("DELETE FROM windows WHERE symbol = ? AND interval = ?", (symbol, interval))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,175 @@
+import ast
+import hashlib
+import json
+import os
+import time
+from typing import NamedTuple
+
+import pandas as pd
+
+EXCHANGE_INFO_FILE = "exchangeInfo.json"
+RAW_EXCHANGE_INFO_FILE = "exchangeInfo.raw.json"
+EXCHANGE_INFO_TTL = 24 * 60 * 60
+
+
+class SymbolInfo(NamedTuple):
+    symbol: str
+    status: str
+    base: str
+    quote: str
+    tick_size: float
+    step_size: float
+    min_notional: float
+    base_precision: int
+    quote_precision: int
+
+
+def parse_symbol(symbol):
+    """
+    SymbolInfo out of one entry of exchangeInfo['symbols']
+    """
+    filters = {f['filterType']: f for f in symbol.get('filters', [])}
+    # newer symbols carry NOTIONAL instead of MIN_NOTIONAL
+    notional = filters.get('MIN_NOTIONAL', filters.get('NOTIONAL', {}))
+    return SymbolInfo(symbol['symbol'], symbol['status'], symbol['baseAsset'], symbol['quoteAsset'],
+                      float(filters.get('PRICE_FILTER', {}).get('tickSize', 0)),
+                      float(filters.get('LOT_SIZE', {}).get('stepSize', 0)),
+                      float(notional.get('minNotional', 0)),
+                      int(symbol.get('baseAssetPrecision', 8)), int(symbol.get('quoteAssetPrecision', 8)))
+
+
+def content_hash(exchange_info):
+    """
+    sha256 of the symbols and rate limits, serverTime is left out so that only real changes change it
+    """
+    content = {'symbols': exchange_info.get('symbols', []), 'rateLimits': exchange_info.get('rateLimits', [])}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+class ExchangeInfoCache:
+    """
+    exchangeInfo downloaded again only once it is older than ttl seconds. The parsed SymbolInfo table and the rate
+    limits go to a compact {base_path}/exchangeInfo.json which is all a lookup needs, the full payload is kept next
+    to it in exchangeInfo.raw.json and only read by raw().
+    """
+
+    def __init__(self, base_path, ttl=EXCHANGE_INFO_TTL, data_getter=None):
+        self.path = os.path.join(base_path, EXCHANGE_INFO_FILE)
+        self.raw_path = os.path.join(base_path, RAW_EXCHANGE_INFO_FILE)
+        self.ttl = ttl
+        self.data_getter = data_getter
+        self.hash = None
+        self.fetched_at = None
+        self.infos = None
+        self.rate_limit_rows = []
+        self.changed = False
+
+    def _fetch(self):
+        if self.data_getter is None:
+            from data_analysis.data_getter import DataGetterSymbol
+
+            self.data_getter = DataGetterSymbol("None")
+        return self.data_getter._handle_request("EXCHANGE_INFO")
+
+    @staticmethod
+    def _write_json(data, path):
+        with open(path + ".tmp", "w") as handle:
+            json.dump(data, handle, separators=(',', ':'))
+        os.replace(path + ".tmp", path)
+
+    def _store(self, exchange_info, fetched_at):
+        self.hash = content_hash(exchange_info)
+        self.fetched_at = fetched_at
+        self.infos = {s['symbol']: parse_symbol(s) for s in exchange_info['symbols']}
+        self.rate_limit_rows = exchange_info.get('rateLimits', [])
+        self._write_json(exchange_info, self.raw_path)
+        self._write_json({'fetched_at': self.fetched_at, 'hash': self.hash, 'fields': list(SymbolInfo._fields),
+                          'symbols': [list(info) for info in self.infos.values()],
+                          'rateLimits': self.rate_limit_rows}, self.path)
+
+    def load(self, force=False):
+        """
+        Reads the cache and refreshes it when it expired or force is set, changed tells whether the refresh brought
+        a different exchangeInfo
+        """
+        if (self.infos is None) and os.path.exists(self.path):
+            with open(self.path) as handle:
+                cached = json.load(handle)
+            if cached.get('fields') == list(SymbolInfo._fields):
+                self.fetched_at, self.hash = cached['fetched_at'], cached['hash']
+                self.infos = {row[0]: SymbolInfo(*row) for row in cached['symbols']}
+                self.rate_limit_rows = cached['rateLimits']
+
+        self.changed = False
+        if force or (self.infos is None) or (time.time() - self.fetched_at > self.ttl):
+            previous = self.hash
+            self._store(self._fetch(), time.time())
+            self.changed = previous != self.hash
+        return self
+
+    def refresh(self):
+        return self.load(force=True)
+
+    def raw(self):
+        with open(self._loaded().raw_path) as handle:
+            return json.load(handle)
+
+    def _loaded(self):
+        if self.infos is None:
+            self.load()
+        return self
+
+    def get(self, symbol):
+        return self._loaded().infos[symbol]
+
+    def tick_size(self, symbol):
+        return self.get(symbol).tick_size
+
+    def step_size(self, symbol):
+        return self.get(symbol).step_size
+
+    def min_notional(self, symbol):
+        return self.get(symbol).min_notional
+
+    def symbols(self, status='TRADING', quote=None):
+        return [s for s, info in self._loaded().infos.items()
+                if ((status is None) or (info.status == status)) and ((quote is None) or (info.quote == quote))]
+
+    def rate_limits(self):
+        return pd.DataFrame(self._loaded().rate_limit_rows)
+
+    def to_frame(self):
+        """
+        One row per symbol with the columns of the exchangeInfo csv used across the repo
+        """
+        data = pd.DataFrame(list(self._loaded().infos.values()))
+        return data.rename(columns={'base': 'baseAsset', 'quote': 'quoteAsset'})
+
+    @classmethod
+    def from_csv(cls, csv_path, base_path, rate_limits_path=None):
+        """
+        Converts an exchangeInfo.csv saved by get_exchange_info, whose filters are python reprs, into the cache
+        """
+        data = pd.read_csv(csv_path)
+        symbols = data.to_dict(orient='records')
+        for symbol in symbols:
+            for column in ['filters', 'orderTypes', 'permissions']:
+                if isinstance(symbol.get(column), str):
+                    symbol[column] = ast.literal_eval(symbol[column])
+        rate_limits = [] if rate_limits_path is None else \
+            pd.read_csv(rate_limits_path, index_col=0).to_dict(orient='records')
+        cache = cls(base_path)
+        cache._store({'symbols': symbols, 'rateLimits': rate_limits}, os.path.getmtime(csv_path))
+        return cache
+
+
+if __name__ == "__main__":
+    exchange_path = os.path.join(os.path.dirname(__file__), "..", "data", "exchange")
+    started = time.time()
+    info_cache = ExchangeInfoCache.from_csv(os.path.join(exchange_path, "exchangeInfo.csv"), exchange_path,
+                                            os.path.join(exchange_path, "rateLimits.csv"))
+    print(f"converted in {time.time() - started} seconds")
+    started = time.time()
+    info_cache = ExchangeInfoCache(exchange_path, ttl=float('inf')).load()
+    print(f"loaded {len(info_cache.infos)} symbols in {time.time() - started} seconds")
+    print(info_cache.get("BTCUSDT"))
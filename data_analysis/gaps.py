@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+from data_analysis.constants import VALID_INTERVALS_TO_TIME
+from data_analysis.resampling import interval_close_times
+
+CANDLES_PER_REQUEST = 1000
+
+
+def find_gaps(open_time, interval):
+    """
+    Start and end in milliseconds of the missing ranges between sorted open times
+    """
+    open_time = np.asarray(open_time, dtype=np.int64)
+    if len(open_time) < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    expected = interval_close_times(open_time[:-1], interval) + 1
+    is_gap = open_time[1:] > expected
+    return expected[is_gap], open_time[1:][is_gap] - 1
+
+
+def scan_store_gaps(store, symbols=None, interval='1m'):
+    """
+    Gap index (symbol, interval, start, end, missing) of every symbol in the store, only open_time is read
+    """
+    symbols = store.symbols() if symbols is None else symbols
+    frames = []
+    for symbol in symbols:
+        open_time = store.read(symbol, interval, columns=['open_time'])['open_time'].values
+        gap_start, gap_end = find_gaps(open_time, interval)
+        if len(gap_start) > 0:
+            frames.append(pd.DataFrame({'symbol': symbol, 'interval': interval, 'start': gap_start, 'end': gap_end}))
+
+    if len(frames) == 0:
+        return pd.DataFrame({'symbol': pd.Series(dtype=object), 'interval': pd.Series(dtype=object),
+                             'start': pd.Series(dtype=np.int64), 'end': pd.Series(dtype=np.int64),
+                             'missing': pd.Series(dtype=np.int64)})
+    gaps = pd.concat(frames, ignore_index=True)
+    gaps['missing'] = (gaps['end'] - gaps['start'] + 1) // VALID_INTERVALS_TO_TIME[interval]
+    return gaps
+
+
+def gap_windows(gaps, candles_per_request=CANDLES_PER_REQUEST):
+    """
+    Packs neighbouring gaps of the same series into request windows of at most candles_per_request candles and
+    splits the gaps which are longer than that, returns (symbol, interval, start, end)
+    """
+    windows = []
+    for (symbol, interval), group in gaps.sort_values(by=['symbol', 'interval', 'start']).groupby(
+            ['symbol', 'interval'], sort=False):
+        span = VALID_INTERVALS_TO_TIME[interval] * candles_per_request
+        window_start = window_end = None
+        for start, end in zip(group['start'].tolist(), group['end'].tolist()):
+            if (window_start is not None) and (end <= window_start + span - 1):
+                window_end = end
+                continue
+            if window_start is not None:
+                windows.append((symbol, interval, window_start, window_end))
+            while end - start + 1 > span:
+                windows.append((symbol, interval, start, start + span - 1))
+                start += span
+            window_start, window_end = start, end
+        if window_start is not None:
+            windows.append((symbol, interval, window_start, window_end))
+    return windows
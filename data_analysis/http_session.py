@@ -0,0 +1,59 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+POOL_SIZE = 10
+# (connect, read) in seconds
+TIMEOUT = (3.05, 30)
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+# retried by send_request with a new rate limiter reservation, 429 and 418 are left to the rate limiter
+RETRY_STATUSES = (500, 502, 503, 504)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class PooledSession(requests.Session):
+    """
+    Keep-alive session whose connection pool is shared by all the threads of a process. Only the connections and
+    reads which failed are retried here, a response with an error status goes back to the caller as the server
+    counted its weight.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, timeout=TIMEOUT, retries=RETRIES, backoff_factor=BACKOFF_FACTOR):
+        super().__init__()
+        self.timeout = timeout
+        retry = Retry(total=retries, connect=retries, read=retries, status=0, backoff_factor=backoff_factor,
+                      allowed_methods=frozenset(["GET"]), raise_on_status=False)
+        # pool_block stops extra threads from opening throwaway connections once the pool is in use
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry, pool_block=True)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.headers.update({"Connection": "keep-alive"})
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def get_session(pool_size=POOL_SIZE):
+    """
+    One session per process, a forked child must not reuse the sockets of its parent
+    """
+    pid = os.getpid()
+    with _sessions_lock:
+        if pid not in _sessions:
+            _sessions[pid] = PooledSession(pool_size=pool_size)
+        return _sessions[pid]
+
+
+def set_session(session):
+    """
+    Replaces the session of the current process, e.g. with PooledSession(timeout=..., retries=...)
+    """
+    with _sessions_lock:
+        _sessions[os.getpid()] = session
@@ -0,0 +1,389 @@
+"""
+Every indicator comes as a batch function over whole arrays (one series or a bars x symbols matrix) and as a class
+updated one bar at a time in O(1). Both do the same floating point operations in the same order, so the incremental
+values are bit for bit the ones of the batch function.
+"""
+
+import collections
+
+import numpy as np
+import pandas as pd
+
+from data_analysis.constants import CANDLES_HEADER
+
+OPEN, HIGH, LOW, CLOSE, VOLUME = [CANDLES_HEADER.index(c) for c in ['open', 'high', 'low', 'close', 'volume']]
+
+
+def as_2d(values):
+    values = np.asarray(values, dtype=np.float64)
+    return values[:, None] if values.ndim == 1 else values
+
+
+def _like(result, values):
+    return result[:, 0] if np.ndim(values) == 1 else result
+
+
+def ewm_alpha(halflife=None, alpha=None):
+    """
+    alpha the way pandas derives it from halflife or alpha
+    """
+    if halflife is not None:
+        decay = 1 - np.exp(np.log(0.5) / halflife)
+        comass = 1 / decay - 1
+    else:
+        comass = (1 - alpha) / alpha
+    return 1. / (1. + float(comass))
+
+
+def ewma(values, halflife=None, alpha=None, adjust=True):
+    """
+    pandas ewm(...).mean() of every column at once
+    """
+    frame = pd.DataFrame(as_2d(values))
+    mean = frame.ewm(halflife=halflife, alpha=alpha, adjust=adjust).mean().values
+    return _like(mean, values)
+
+
+class EWMA:
+    """
+    The recurrence of pandas' ewm mean, ignore_na=False
+    """
+
+    def __init__(self, halflife=None, alpha=None, adjust=True):
+        alpha = ewm_alpha(halflife, alpha)
+        self.old_wt_factor = 1. - alpha
+        self.new_wt = 1. if adjust else alpha
+        self.adjust = adjust
+        self.old_wt = 1.
+        self.weighted = None
+        self.value = np.nan
+
+    def update(self, x):
+        x = float(x)
+        is_observation = x == x
+        if self.weighted is None:
+            self.weighted = x
+        elif self.weighted == self.weighted:
+            self.old_wt *= self.old_wt_factor
+            if is_observation:
+                if self.weighted != x:
+                    self.weighted = (self.old_wt * self.weighted + self.new_wt * x) / (self.old_wt + self.new_wt)
+                self.old_wt = self.old_wt + self.new_wt if self.adjust else 1.
+        elif is_observation:
+            self.weighted = x
+        self.value = self.weighted
+        return self.value
+
+
+def _rolling_sums(values, n, valid=None):
+    """
+    Sums of the windows of the last n rows from the differences of the cumulative sum, with the number of valid rows
+    of each window from a second cumulative sum. Rows which are not valid, the nan ones by default, add 0 so a missing
+    bar only counts in the windows it is part of.
+    """
+    values = as_2d(values)
+    valid = ~np.isnan(values) if valid is None else as_2d(valid).astype(bool)
+    rows = len(values)
+    first = np.maximum(np.arange(rows) + 1 - n, 0)
+    total = np.zeros((rows + 1, values.shape[1]))
+    np.cumsum(np.where(valid, values, 0.), axis=0, out=total[1:])
+    counts = np.zeros((rows + 1, values.shape[1]))
+    np.cumsum(valid, axis=0, out=counts[1:])
+    return total[1:] - total[first], counts[1:] - counts[first]
+
+
+def _window_means(sums, counts, min_periods):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts >= min_periods, sums / counts, np.nan)
+
+
+class _RollingSum:
+
+    def __init__(self, n):
+        self.n = n
+        self.total = 0.
+        self.count = 0.
+        self.totals = collections.deque([(0., 0.)], maxlen=n + 1)
+
+    def update(self, x, valid=None):
+        """
+        (sum, valid rows) of the window ending with x
+        """
+        valid = (x == x) if valid is None else valid
+        self.total = self.total + (x if valid else 0.)
+        self.count = self.count + (1. if valid else 0.)
+        self.totals.append((self.total, self.count))
+        # the first entry is (0, 0) until n rows were added
+        return self.total - self.totals[0][0], self.count - self.totals[0][1]
+
+
+def sma(values, n, min_periods=None):
+    """
+    Mean of the valid values of the last n rows, nan when there are fewer than min_periods of them (n by default)
+    like rolling(n).mean()
+    """
+    sums, counts = _rolling_sums(values, n)
+    return _like(_window_means(sums, counts, n if min_periods is None else min_periods), values)
+
+
+class SMA:
+
+    def __init__(self, n, min_periods=None):
+        self.n = n
+        self.min_periods = n if min_periods is None else min_periods
+        self.sums = _RollingSum(n)
+        self.value = np.nan
+
+    def update(self, x):
+        total, count = self.sums.update(float(x))
+        self.value = total / count if count >= self.min_periods else np.nan
+        return self.value
+
+
+def _rolling_extreme(values, n, extreme, fill):
+    """
+    van Herk / Gil-Werman: the extreme of each window is the one of a block suffix and of the next block prefix
+    """
+    values = as_2d(values)
+    rows, columns = values.shape
+    result = np.full(values.shape, np.nan)
+    if rows < n:
+        return result
+    blocks = -(-rows // n)
+    padded = np.full((blocks * n, columns), fill)
+    padded[:rows] = values
+    padded = padded.reshape(blocks, n, columns)
+    prefix = extreme.accumulate(padded, axis=1).reshape(-1, columns)
+    suffix = extreme.accumulate(padded[:, ::-1], axis=1)[:, ::-1].reshape(-1, columns)
+    result[n - 1:] = extreme(suffix[:rows - n + 1], prefix[n - 1:rows])
+    return result
+
+
+def rolling_max(values, n):
+    return _like(_rolling_extreme(values, n, np.maximum, -np.inf), values)
+
+
+def rolling_min(values, n):
+    return _like(_rolling_extreme(values, n, np.minimum, np.inf), values)
+
+
+class RollingMax:
+    """
+    Monotonic deque of (bar, value), the front holds the extreme of the window. Like rolling_max the value is nan
+    while a nan is inside the window.
+    """
+    sign = 1.
+
+    def __init__(self, n):
+        self.n = n
+        self.bar = -1
+        self.last_nan = None
+        self.window = collections.deque()
+        self.value = np.nan
+
+    def update(self, x):
+        x = float(x)
+        self.bar += 1
+        if x != x:
+            self.last_nan = self.bar
+        else:
+            while self.window and self.sign * self.window[-1][1] <= self.sign * x:
+                self.window.pop()
+            self.window.append((self.bar, x))
+        if self.window and (self.window[0][0] <= self.bar - self.n):
+            self.window.popleft()
+        nan_inside = (self.last_nan is not None) and (self.last_nan > self.bar - self.n)
+        self.value = self.window[0][1] if (self.bar >= self.n - 1) and not nan_inside else np.nan
+        return self.value
+
+
+class RollingMin(RollingMax):
+    sign = -1.
+
+
+def typical_price(high, low, close):
+    return (np.asarray(high, dtype=np.float64) + low + close) / 3
+
+
+def vwap(high, low, close, volume, n, min_periods=None):
+    """
+    Volume weighted typical price of the valid bars of the last n, nan when there are fewer than min_periods of them
+    """
+    volume = np.asarray(volume, dtype=np.float64)
+    price_volume = as_2d(typical_price(high, low, close) * volume)
+    valid = ~np.isnan(price_volume)
+    price_volume_sums, counts = _rolling_sums(price_volume, n, valid)
+    volume_sums, _ = _rolling_sums(volume, n, valid)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = price_volume_sums / volume_sums
+    result[(counts < (n if min_periods is None else min_periods)) | (volume_sums == 0)] = np.nan
+    return _like(result, volume)
+
+
+class VWAP:
+
+    def __init__(self, n, min_periods=None):
+        self.min_periods = n if min_periods is None else min_periods
+        self.price_volume = _RollingSum(n)
+        self.volume = _RollingSum(n)
+        self.value = np.nan
+
+    def update(self, high, low, close, volume):
+        volume = float(volume)
+        price_volume = (float(high) + float(low) + float(close)) / 3 * volume
+        valid = price_volume == price_volume
+        price_volume_sum, count = self.price_volume.update(price_volume, valid)
+        volume_sum, _ = self.volume.update(volume, valid)
+        self.value = price_volume_sum / volume_sum if (count >= self.min_periods) and (volume_sum != 0) else np.nan
+        return self.value
+
+
+def true_range(high, low, close):
+    high, low, close = as_2d(high), as_2d(low), as_2d(close)
+    previous = np.empty(close.shape)
+    previous[0] = np.nan
+    previous[1:] = close[:-1]
+    # after a missing close the range is high - low like on the first bar
+    ranges = np.fmax(high - low, np.fmax(np.abs(high - previous), np.abs(low - previous)))
+    ranges[0] = high[0] - low[0]
+    return ranges
+
+
+def atr(high, low, close, n):
+    """
+    Wilder's average true range: the mean of the first n true ranges, then an ewm with alpha 1 / n
+    """
+    ranges = true_range(high, low, close)
+    seeded = np.full(ranges.shape, np.nan)
+    if len(ranges) < n:
+        return _like(seeded, close)
+    sums, counts = _rolling_sums(ranges[:n], n)
+    # like the incremental total, a nan true range leaves the seed nan
+    seeded[n - 1] = np.where(counts[n - 1] == n, sums[n - 1] / n, np.nan)
+    seeded[n:] = ranges[n:]
+    result = pd.DataFrame(seeded).ewm(alpha=1 / n, adjust=False).mean().values
+    return _like(result, close)
+
+
+class ATR:
+
+    def __init__(self, n):
+        self.n = n
+        self.bars = 0
+        self.total = 0.
+        self.previous_close = None
+        self.smoothing = EWMA(alpha=1 / n, adjust=False)
+        self.value = np.nan
+
+    def update(self, high, low, close):
+        high, low, close = float(high), float(low), float(close)
+        if (self.previous_close is None) or (self.previous_close != self.previous_close):
+            true_range_ = high - low
+        else:
+            true_range_ = max(high - low, max(abs(high - self.previous_close), abs(low - self.previous_close)))
+        self.previous_close = close
+        self.bars += 1
+        if self.bars < self.n:
+            self.total = self.total + true_range_
+        elif self.bars == self.n:
+            self.value = self.smoothing.update((self.total + true_range_) / self.n)
+        else:
+            self.value = self.smoothing.update(true_range_)
+        return self.value
+
+
+def crossover(series1, series2):
+    """
+    True on the bars where series1 goes from below series2 to above it, like backtesting.lib.crossover
+    """
+    series1, series2 = as_2d(series1), as_2d(series2)
+    crossed = np.zeros(series1.shape, dtype=bool)
+    crossed[1:] = (series1[:-1] < series2[:-1]) & (series1[1:] > series2[1:])
+    return crossed
+
+
+def cross_signals(fast, slow):
+    """
+    +1 where fast crosses above slow, -1 where it crosses below, 0 elsewhere
+    """
+    return crossover(fast, slow).astype(np.int8) - crossover(slow, fast).astype(np.int8)
+
+
+class Crossover:
+
+    def __init__(self):
+        self.previous = None
+        self.value = 0
+
+    def update(self, fast, slow):
+        fast, slow = float(fast), float(slow)
+        self.value = 0
+        if self.previous is not None:
+            if (self.previous[0] < self.previous[1]) and (fast > slow):
+                self.value = 1
+            elif (self.previous[1] < self.previous[0]) and (slow > fast):
+                self.value = -1
+        self.previous = (fast, slow)
+        return self.value
+
+
+class EWMACrossIndicator:
+    """
+    Incremental counterpart of ewma_cross_signals, updated with a candle in the CANDLES_HEADER order
+    """
+
+    def __init__(self, fast_hl, slow_hl):
+        self.fast = EWMA(fast_hl)
+        self.slow = EWMA(slow_hl)
+        self.cross = Crossover()
+
+    def update(self, bar):
+        close = bar[CLOSE]
+        return {'fast_ewma': self.fast.update(close), 'slow_ewma': self.slow.update(close),
+                'signal': self.cross.update(self.fast.value, self.slow.value)}
+
+
+class CandleIndicators:
+    """
+    Named indicators updated with each candle in the CANDLES_HEADER order, {name: (indicator, fields)}
+    """
+
+    def __init__(self, indicators):
+        self.indicators = indicators
+        self.values = {}
+
+    @classmethod
+    def default(cls, n=14, fast_hl=1000, slow_hl=2000):
+        return cls({'sma': (SMA(n), [CLOSE]), 'high': (RollingMax(n), [HIGH]), 'low': (RollingMin(n), [LOW]),
+                    'vwap': (VWAP(n), [HIGH, LOW, CLOSE, VOLUME]), 'atr': (ATR(n), [HIGH, LOW, CLOSE]),
+                    'ewma_cross': (EWMACrossIndicator(fast_hl, slow_hl), None)})
+
+    def update(self, bar):
+        for name, (indicator, fields) in self.indicators.items():
+            self.values[name] = indicator.update(bar) if fields is None else \
+                indicator.update(*[bar[f] for f in fields])
+        return self.values
+
+
+class LiveIndicators:
+    """
+    Callback of a KlineAggregator which keeps a CandleIndicators per (symbol, interval) up to date with every
+    closed candle, then calls on_update(symbol, interval, bar, values)
+    """
+
+    def __init__(self, factory=CandleIndicators.default, on_update=None):
+        self.factory = factory
+        self.on_update = on_update
+        self.indicators = {}
+
+    def __call__(self, symbol, interval, bars):
+        key = (symbol, interval)
+        if key not in self.indicators:
+            self.indicators[key] = self.factory()
+        for bar in bars:
+            values = self.indicators[key].update(bar)
+            if self.on_update is not None:
+                self.on_update(symbol, interval, bar, values)
+
+    def values(self, symbol, interval):
+        return self.indicators[(symbol, interval)].values
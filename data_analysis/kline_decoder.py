@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from data_analysis.constants import CANDLES_HEADER, CANDLES_HEADER_TYPES
+
+KLINE_FIELDS = len(CANDLES_HEADER)
+# every field of a kline is a number or a quoted number, so without these bytes the page is a flat list of numbers
+KLINE_DELETE = b'[]"'
+
+
+def decode_kline_values(content):
+    """
+    Flat float64 array of the fields of a raw klines response, parsed by numpy without building a python object per
+    field. Times and counts stay exact as they are far below 2 ** 53.
+    """
+    if isinstance(content, str):
+        content = content.encode()
+    content = content.translate(None, KLINE_DELETE).strip()
+    if len(content) == 0:
+        return np.empty(0, dtype=np.float64)
+    values = np.fromstring(content, dtype=np.float64, sep=',')
+    if len(values) % KLINE_FIELDS != 0:
+        raise ValueError(f"klines response has {len(values)} fields, not a multiple of {KLINE_FIELDS}")
+    return values
+
+
+def decode_klines_columns(content):
+    """
+    Typed column arrays, one per CANDLES_HEADER field with its CANDLES_HEADER_TYPES dtype
+    """
+    values = decode_kline_values(content).reshape(-1, KLINE_FIELDS)
+    columns = {}
+    for i, column in enumerate(CANDLES_HEADER):
+        columns[column] = np.empty(len(values), dtype=CANDLES_HEADER_TYPES[column])
+        columns[column][:] = values[:, i]
+    return columns
+
+
+def decode_klines(content):
+    """
+    DataFrame of CANDLES_HEADER typed as CANDLES_HEADER_TYPES straight from the response bytes
+    """
+    return pd.DataFrame(decode_klines_columns(content), columns=CANDLES_HEADER)
@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from data_analysis.candle_store import CandleStore
+from data_analysis.constants import CANDLES_HEADER, CANDLES_HEADER_TYPES, VALID_INTERVALS
+
+CHUNK_ROWS = 1000000
+DONE_LOG = "_migration_done.jsonl"
+# {symbol}.csv, {symbol}_{interval}.csv or {symbol}_{interval}_{anything}.csv
+SYMBOL_FILE = re.compile(r"^(?P<symbol>[A-Z0-9]+?)(?:_(?P<interval>" + "|".join(VALID_INTERVALS) + r"))?(?:_.*)?\.csv$")
+DATE_FILE = re.compile(r"^(?P<date>\d{8})\.csv$")
+
+
+def checksum(data):
+    """
+    Order independent checksum of typed candles, the wrapping sum of the hashes of their rows
+    """
+    if len(data) == 0:
+        return 0
+    hashes = pd.util.hash_pandas_object(data[CANDLES_HEADER].astype(CANDLES_HEADER_TYPES), index=False)
+    return int(hashes.values.sum(dtype=np.uint64))
+
+
+def combine(checksums):
+    return int(np.array(checksums, dtype=np.uint64).sum(dtype=np.uint64))
+
+
+def read_chunks(path, chunk_rows=CHUNK_ROWS, extra_columns=()):
+    """
+    Typed chunks of a candles csv with or without header, only CANDLES_HEADER and extra_columns are parsed
+    """
+    with open(path) as handle:
+        first_line = handle.readline()
+    if first_line[:1].isdigit():
+        names, header = CANDLES_HEADER + list(extra_columns), None
+    else:
+        names, header = None, 0
+    dtype = dict(CANDLES_HEADER_TYPES)
+    dtype.update({c: str for c in extra_columns})
+    return pd.read_csv(path, header=header, names=names, usecols=CANDLES_HEADER + list(extra_columns), dtype=dtype,
+                       chunksize=chunk_rows)
+
+
+def find_units(symbols_path=None, dates_path=None, interval='1m'):
+    """
+    Units of work: ('series', symbol, interval, [paths]) for the files of one series of the symbols folder, which are
+    written by the same process, and ('date', None, interval, [path]) for each day file of the dates folder
+    """
+    units = []
+    if symbols_path is not None:
+        series = {}
+        for name in sorted(os.listdir(symbols_path)):
+            match = SYMBOL_FILE.match(name)
+            if match is None:
+                continue
+            key = (match.group('symbol'), match.group('interval') or interval)
+            series.setdefault(key, []).append(os.path.join(symbols_path, name))
+        units.extend(('series', symbol, series_interval, paths) for (symbol, series_interval), paths in series.items())
+    if dates_path is not None:
+        units.extend(('date', None, interval, [os.path.join(dates_path, name)])
+                     for name in sorted(os.listdir(dates_path)) if DATE_FILE.match(name))
+    return units
+
+
+def source_key(path):
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}|{stat.st_size}|{int(stat.st_mtime)}"
+
+
+def migrate_unit(store_path, unit, chunk_rows=CHUNK_ROWS):
+    """
+    Writes the files of a unit to the store without touching the _meta.json of the series, returns the stats of the
+    written files and, per (symbol, interval), the rows, range, open times and checksum of the source
+    """
+    kind, symbol, interval, paths = unit
+    store = CandleStore(store_path)
+    written = {}
+    sources = {}
+    for path in paths:
+        for chunk in read_chunks(path, chunk_rows, extra_columns=['sym'] if kind == 'date' else []):
+            groups = chunk.groupby('sym', sort=False) if kind == 'date' else [(symbol, chunk)]
+            for chunk_symbol, data in groups:
+                key = f"{chunk_symbol}|{interval}"
+                written.setdefault(key, {}).update(store.write(chunk_symbol, interval, data[CANDLES_HEADER],
+                                                               update_meta=False))
+                source = sources.setdefault(key, {'rows': 0, 'checksum': 0, 'open_times': []})
+                source['rows'] += len(data)
+                source['checksum'] = combine([source['checksum'], checksum(data)])
+                source['open_times'].append(data['open_time'].values)
+    for source in sources.values():
+        open_times = np.unique(np.concatenate(source.pop('open_times')))
+        source['duplicates'] = source['rows'] - len(open_times)
+        source['min'], source['max'] = int(open_times[0]), int(open_times[-1])
+        source['open_times'] = open_times
+    return written, sources
+
+
+def verify(store, sources):
+    """
+    Reads the stored candles of the open times of every source back and compares rows and checksums, returns the
+    mismatches. The checksum is only compared for sources without duplicated open times, as the store keeps one of
+    them.
+    """
+    mismatches = []
+    for key, source in sources.items():
+        symbol, interval = key.split("|")
+        stored = store.read(symbol, interval, source['min'], source['max'])
+        stored = stored[np.isin(stored['open_time'].values, source['open_times'])]
+        stored_checksum = checksum(stored)
+        expected_rows = source['rows'] - source['duplicates']
+        if (len(stored) != expected_rows) or ((source['duplicates'] == 0) and (stored_checksum != source['checksum'])):
+            mismatches.append({'series': key, 'source_rows': expected_rows, 'stored_rows': len(stored),
+                               'source_checksum': source['checksum'], 'stored_checksum': stored_checksum})
+    return mismatches
+
+
+def _migrate_and_verify(store_path, unit, chunk_rows, check):
+    written, sources = migrate_unit(store_path, unit, chunk_rows)
+    mismatches = verify(CandleStore(store_path), sources) if check else []
+    for source in sources.values():
+        del source['open_times']
+    return written, sources, mismatches
+
+
+class ArchiveMigration:
+    """
+    Converts the csv archive, the symbols folder of one csv per series and the dates folder of one csv per day, into
+    the typed parquet CandleStore over a process pool.
+
+    Files are parsed in typed chunks of chunk_rows rows so memory stays bounded whatever their size. A unit which was
+    migrated, and verified when check is set, is recorded in {store}/_migration_done.jsonl with the size and mtime of
+    its files and skipped by the next runs, so an interrupted migration is resumed by running it again. Only this
+    process updates the _meta.json of the series and the done log.
+    """
+
+    def __init__(self, store_path, symbols_path=None, dates_path=None, interval='1m', workers=None,
+                 chunk_rows=CHUNK_ROWS, check=True):
+        self.store = CandleStore(store_path)
+        self.store_path = store_path
+        self.units = find_units(symbols_path, dates_path, interval)
+        self.workers = os.cpu_count() if workers is None else workers
+        self.chunk_rows = chunk_rows
+        self.check = check
+        self.done_log = os.path.join(store_path, DONE_LOG)
+
+    def done(self):
+        if not os.path.exists(self.done_log):
+            return set()
+        with open(self.done_log) as handle:
+            return set(json.loads(line)['key'] for line in handle if line.strip())
+
+    def _unit_key(self, unit):
+        return ";".join(source_key(p) for p in unit[3])
+
+    def _record(self, unit, sources, mismatches):
+        with open(self.done_log, "a") as handle:
+            handle.write(json.dumps({'key': self._unit_key(unit), 'sources': sources,
+                                     'verified': self.check and len(mismatches) == 0}) + "\n")
+
+    def run(self):
+        os.makedirs(self.store_path, exist_ok=True)
+        done = self.done()
+        pending = [u for u in self.units if self._unit_key(u) not in done]
+        print(f"{len(self.units)} units, {len(self.units) - len(pending)} already migrated, {len(pending)} to go")
+        if len(pending) == 0:
+            return []
+
+        # days of the same series written by both folders would race for the same day file
+        phases = [[u for u in pending if u[0] == 'series'], [u for u in pending if u[0] == 'date']]
+        total_bytes = sum(os.path.getsize(p) for u in pending for p in u[3])
+        done_bytes, done_units, started = 0, 0, time.time()
+        failed = []
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for phase in phases:
+                futures = {executor.submit(_migrate_and_verify, self.store_path, unit, self.chunk_rows, self.check):
+                           unit for unit in phase}
+                for future in as_completed(futures):
+                    unit = futures[future]
+                    done_units += 1
+                    done_bytes += sum(os.path.getsize(p) for p in unit[3])
+                    name = os.path.basename(unit[3][0]) if unit[1] is None else f"{unit[1]} {unit[2]}"
+                    try:
+                        written, sources, mismatches = future.result()
+                    except Exception as err:
+                        print(f"[{done_units}/{len(pending)}] {name} failed: {err}")
+                        failed.append((unit, str(err)))
+                        continue
+                    for key, files in written.items():
+                        symbol, interval = key.split("|")
+                        self.store.update_meta(symbol, interval, files)
+                    if len(mismatches) > 0:
+                        print(f"[{done_units}/{len(pending)}] {name} does not verify: {mismatches}")
+                        failed.append((unit, mismatches))
+                        continue
+                    self._record(unit, sources, mismatches)
+                    duplicates = sum(s['duplicates'] for s in sources.values())
+                    if duplicates > 0:
+                        print(f"{name}: {duplicates} duplicated open times, the last one of each is kept")
+                    elapsed = time.time() - started
+                    speed = done_bytes / elapsed / 1024 ** 2
+                    eta = (total_bytes - done_bytes) / max(done_bytes / elapsed, 1)
+                    print(f"[{done_units}/{len(pending)}] {name}: {sum(s['rows'] for s in sources.values())} rows, "
+                          f"{speed:.1f} MB/s, {eta / 60:.1f} minutes left")
+        print(f"migrated {len(pending) - len(failed)} units in {(time.time() - started) / 60:.1f} minutes, "
+              f"{len(failed)} failed")
+        return failed
+
+    def compact(self):
+        """
+        Merges the segments left by the migration, one series per process
+        """
+        series = [(s, i) for s in self.store.symbols() for i in sorted(os.listdir(os.path.join(self.store_path, s)))]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(CandleStore(self.store_path).compact, s, i): (s, i) for s, i in series}
+            for future in as_completed(futures):
+                if future.result() > 0:
+                    print(f"{futures[future][0]} {futures[future][1]}: compacted {future.result()} days")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Migrates the csv candles archive into the CandleStore")
+    parser.add_argument("store", help="base path of the CandleStore")
+    parser.add_argument("--symbols", help="folder of {symbol}_{interval}.csv files")
+    parser.add_argument("--dates", help="folder of {yyyymmdd}.csv files")
+    parser.add_argument("--interval", default="1m", choices=VALID_INTERVALS,
+                        help="interval of the files whose name does not carry one")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--no-verify", action="store_true", help="skips reading the migrated candles back")
+    parser.add_argument("--compact", action="store_true", help="merges the written segments at the end")
+    args = parser.parse_args(args)
+    if (args.symbols is None) and (args.dates is None):
+        parser.error("at least one of --symbols and --dates is needed")
+
+    migration = ArchiveMigration(args.store, args.symbols, args.dates, args.interval, args.workers, args.chunk_rows,
+                                 check=not args.no_verify)
+    failed = migration.run()
+    if args.compact:
+        migration.compact()
+    return 1 if len(failed) > 0 else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
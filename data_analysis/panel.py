@@ -0,0 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from data_analysis.candle_store import DAY_MILLISECONDS, to_milliseconds
+from data_analysis.constants import VALID_INTERVALS_TO_TIME
+
+PANEL_FIELDS = ['close', 'volume', 'quote_asset_volume']
+CHUNK_DAYS = 1
+READ_WORKERS = 16
+
+
+class Panel:
+    """
+    Matrices of a time range, values[field] has one row per open_times and one column per symbol, nan where a symbol
+    has no candle
+    """
+
+    def __init__(self, open_times, symbols, values):
+        self.open_times = open_times
+        self.symbols = symbols
+        self.values = values
+
+    def __getitem__(self, field):
+        return self.values[field]
+
+    def to_frame(self, field):
+        return pd.DataFrame(self.values[field], index=pd.to_datetime(self.open_times, unit='ms'),
+                            columns=self.symbols)
+
+
+class MarketPanel:
+    """
+    Cross sectional view of the CandleStore: the candles of many symbols aligned on a common time axis as
+    (time x symbol) float64 matrices.
+
+    Nothing is read until a range is asked for, only its partitions and fields are read and a long range can be
+    walked in chunks of chunk_days so that memory stays bounded by one chunk. Intervals up to 1d are aligned on their
+    regular grid by computing the row of each candle, the longer ones on the union of the open times.
+    """
+
+    def __init__(self, store, symbols=None, interval='1m', fields=None, workers=READ_WORKERS):
+        self.store = store
+        self.interval = interval
+        self.symbols = [s for s in store.symbols() if store.exists(s, interval)] if symbols is None else list(symbols)
+        self.fields = PANEL_FIELDS if fields is None else list(fields)
+        self.workers = workers
+        step = VALID_INTERVALS_TO_TIME[interval]
+        self.step = step if DAY_MILLISECONDS % step == 0 else None
+
+    def _read(self, symbol, start, end, fields):
+        return self.store.read(symbol, self.interval, start, end, columns=['open_time'] + fields)
+
+    def bounds(self):
+        """
+        (first, last) day with candles over all the symbols
+        """
+        days = [d for s in self.symbols for d, _ in self.store.partitions(s, self.interval)]
+        if len(days) == 0:
+            return None, None
+        return min(days), max(days)
+
+    def last_open_time(self):
+        """
+        Largest stored open_time over all the symbols
+        """
+        last_open_times = [self.store.last_open_time(s, self.interval) for s in self.symbols]
+        last_open_times = [t for t in last_open_times if t is not None]
+        return max(last_open_times) if len(last_open_times) > 0 else None
+
+    def _range(self, start, end):
+        """
+        start and end in milliseconds, the start of the first stored day and the last stored candle when they are None
+        """
+        start, end = to_milliseconds(start), to_milliseconds(end)
+        if start is None:
+            first_day, _ = self.bounds()
+            start = 0 if first_day is None else first_day * DAY_MILLISECONDS
+        if end is None:
+            # bounded by the last candle rather than its day so no empty rows follow it
+            last_open_time = self.last_open_time()
+            end = -1 if last_open_time is None else last_open_time
+        return start, end
+
+    def load(self, start=None, end=None, fields=None):
+        """
+        Panel of the candles with start <= open_time <= end
+        """
+        start, end = self._range(start, end)
+        fields = self.fields if fields is None else list(fields)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            frames = list(executor.map(lambda s: self._read(s, start, end, fields), self.symbols))
+
+        if self.step is not None:
+            first = -(-start // self.step) * self.step
+            open_times = np.arange(first, end + 1, self.step, dtype=np.int64)
+        else:
+            open_times = np.unique(np.concatenate([f['open_time'].values for f in frames] + [np.empty(0, np.int64)]))
+
+        values = {f: np.full((len(open_times), len(self.symbols)), np.nan) for f in fields}
+        for column, frame in enumerate(frames):
+            if len(frame) == 0:
+                continue
+            if self.step is not None:
+                rows = (frame['open_time'].values - open_times[0]) // self.step
+            else:
+                rows = np.searchsorted(open_times, frame['open_time'].values)
+            for field in fields:
+                values[field][rows, column] = frame[field].values
+        return Panel(open_times, list(self.symbols), values)
+
+    def iter_chunks(self, start=None, end=None, chunk_days=CHUNK_DAYS, fields=None):
+        """
+        Panels of consecutive chunks of chunk_days days covering start to end, the whole history by default
+        """
+        start, end = self._range(start, end)
+        for day in range(start // DAY_MILLISECONDS, end // DAY_MILLISECONDS + 1, chunk_days):
+            chunk_start = max(start, day * DAY_MILLISECONDS)
+            chunk_end = min(end, (day + chunk_days) * DAY_MILLISECONDS - 1)
+            yield self.load(chunk_start, chunk_end, fields)
+
+
+if __name__ == "__main__":
+    from data_analysis.candle_store import CandleStore
+
+    panel = MarketPanel(CandleStore(r"G:\crypto\data\store"), interval='1m')
+    print(f"{len(panel.symbols)} symbols")
+    for chunk in panel.iter_chunks('01/01/2023', '07/01/2023'):
+        volume = chunk.to_frame('quote_asset_volume').sum()
+        print(pd.to_datetime(chunk.open_times[0], unit='ms'), volume.sort_values(ascending=False).head(5).to_dict())
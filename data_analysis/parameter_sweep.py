@@ -0,0 +1,185 @@
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from data_analysis.backtester import CASH, COMMISSION, VectorizedBacktest
+from data_analysis.candle_binary import MappedCandles, binary_path, export_store_to_binary
+from data_analysis.indicators import cross_signals, ewma, sma
+
+INDICATORS = {'ewma': ewma, 'sma': sma}
+# combinations sent to a worker at once, they share the prices and the indicators of the task
+TASK_COMBINATIONS = 50
+
+
+def grid(**ranges):
+    """
+    Every combination of the parameter values, grid(fast_hl=[...], slow_hl=[...])
+    """
+    names = list(ranges)
+    return [dict(zip(names, values)) for values in itertools.product(*ranges.values())]
+
+
+def random_search(n, seed=None, **ranges):
+    """
+    n distinct combinations drawn from the parameter values
+    """
+    combinations = grid(**ranges)
+    rng = np.random.default_rng(seed)
+    return [combinations[i] for i in rng.choice(len(combinations), size=min(n, len(combinations)), replace=False)]
+
+
+class EWMACross:
+    """
+    Long when the fast ewma crosses above the slow one and short when it crosses below, the EWMAcross of
+    notebooks/backtesting_strategies.py
+    """
+    name = 'ewma_cross'
+
+    @staticmethod
+    def indicators(params):
+        return [('ewma', params['fast_hl']), ('ewma', params['slow_hl'])]
+
+    @staticmethod
+    def signals(fast, slow):
+        return cross_signals(fast, slow)
+
+
+_mapped = {}
+
+
+def _prices(path, start, end):
+    if path not in _mapped:
+        _mapped[path] = MappedCandles(path)
+    return _mapped[path].slice(start, end)
+
+
+def _indicator_path(cache_path, symbol, interval, candles, name, param):
+    span = f"{candles['open_time'][0]}_{candles['open_time'][-1]}"
+    return os.path.join(cache_path, f"{symbol}_{interval}_{span}_{name}_{param}.npy")
+
+
+def _compute_indicator(path, start, end, cache_path, symbol, interval, name, param):
+    """
+    Computes an indicator over the close prices and saves it where every worker can memory map it, None when the
+    symbol has no candles between start and end
+    """
+    candles = _prices(path, start, end)
+    if len(candles['open_time']) == 0:
+        return None
+    indicator_path = _indicator_path(cache_path, symbol, interval, candles, name, param)
+    if not os.path.exists(indicator_path):
+        values = INDICATORS[name](candles['close'], param)
+        tmp_path = f"{indicator_path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, values)
+        os.replace(tmp_path, indicator_path)
+    return indicator_path
+
+
+def _run_combinations(path, start, end, cache_path, symbol, interval, strategy, combinations, cash, commission,
+                      fractional):
+    candles = _prices(path, start, end)
+    backtest = VectorizedBacktest(candles['open'], candles['close'], cash=cash, commission=commission,
+                                  fractional=fractional)
+    rows = []
+    for params in combinations:
+        indicators = [np.load(_indicator_path(cache_path, symbol, interval, candles, name, param), mmap_mode='r')
+                      for name, param in strategy.indicators(params)]
+        stats = backtest.run(strategy.signals(*indicators), symbols=[symbol]).stats.iloc[0]
+        rows.append({'symbol': symbol, **params, **stats.to_dict()})
+    return rows
+
+
+class ParameterSweep:
+    """
+    Runs a strategy for every parameter combination and symbol over a process pool.
+
+    The candles come from the memory mapped candles files of binary_base_path, so every worker shares the same pages
+    instead of reading its own copy. Every distinct indicator is computed once in a first pass and saved to
+    cache_path as .npy, the backtests then memory map them, so a slow_hl used by 50 combinations costs one ewma.
+    """
+
+    def __init__(self, binary_base_path, cache_path, symbols, interval='1m', strategy=EWMACross, start=None,
+                 end=None, workers=None, cash=CASH, commission=COMMISSION, fractional=False):
+        self.binary_base_path = binary_base_path
+        self.cache_path = cache_path
+        self.symbols = list(symbols)
+        self.interval = interval
+        self.strategy = strategy
+        self.start = start
+        self.end = end
+        self.workers = os.cpu_count() if workers is None else workers
+        self.cash = cash
+        self.commission = commission
+        self.fractional = fractional
+        os.makedirs(cache_path, exist_ok=True)
+
+    def _path(self, symbol):
+        return binary_path(self.binary_base_path, symbol, self.interval)
+
+    def prepare(self, store):
+        """
+        Exports the symbols which have no candles file yet from the CandleStore
+        """
+        os.makedirs(self.binary_base_path, exist_ok=True)
+        for symbol in self.symbols:
+            if not os.path.exists(self._path(symbol)):
+                print(f"exporting {symbol} {self.interval}")
+                export_store_to_binary(store, symbol, self.interval, self._path(symbol))
+
+    def _tasks(self, combinations, symbols):
+        """
+        Combinations of each symbol grouped by their last indicator, e.g. the slow_hl, in chunks of at most
+        TASK_COMBINATIONS
+        """
+        groups = {}
+        for params in combinations:
+            groups.setdefault(self.strategy.indicators(params)[-1], []).append(params)
+        tasks = []
+        for symbol in symbols:
+            for group in groups.values():
+                for i in range(0, len(group), TASK_COMBINATIONS):
+                    tasks.append((symbol, group[i:i + TASK_COMBINATIONS]))
+        return tasks
+
+    def run(self, combinations, results_path=None):
+        started = time.time()
+        indicators = sorted(set(i for p in combinations for i in self.strategy.indicators(p)), key=str)
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(_compute_indicator, self._path(s), self.start, self.end, self.cache_path, s,
+                                       self.interval, name, param): s
+                       for s in self.symbols for name, param in indicators}
+            empty = set()
+            for future in as_completed(futures):
+                if future.result() is None:
+                    empty.add(futures[future])
+            for symbol in sorted(empty):
+                print(f"{symbol}: no candles between {self.start} and {self.end}, skipped")
+            print(f"{len(futures)} indicators ready in {time.time() - started:.1f} seconds")
+
+            tasks = self._tasks(combinations, [s for s in self.symbols if s not in empty])
+            futures = [executor.submit(_run_combinations, self._path(symbol), self.start, self.end, self.cache_path,
+                                       symbol, self.interval, self.strategy, chunk, self.cash, self.commission,
+                                       self.fractional)
+                       for symbol, chunk in tasks]
+            rows = []
+            for done, future in enumerate(as_completed(futures), 1):
+                rows.extend(future.result())
+                print(f"{done}/{len(futures)} tasks done in {time.time() - started:.1f} seconds")
+
+        if len(rows) == 0:
+            return pd.DataFrame()
+        results = pd.DataFrame(rows).sort_values('return_pct', ascending=False).reset_index(drop=True)
+        if results_path is not None:
+            results.to_csv(results_path, index=False)
+        return results
+
+
+if __name__ == "__main__":
+    sweep = ParameterSweep(r"G:\crypto\data\binary", r"G:\crypto\data\indicators", ['ETHUSDT'], start='01/01/2022')
+    halflives = list(range(100, 5001, 100))
+    print(sweep.run(grid(fast_hl=halflives, slow_hl=halflives), results_path=r"G:\crypto\data\ewma_cross_sweep.csv")
+          .head(20))
@@ -0,0 +1,144 @@
+import collections
+import itertools
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_analysis.candle_store import DAY_MILLISECONDS, empty_candles
+from data_analysis.constants import CANDLES_HEADER, CANDLES_HEADER_TYPES
+from data_analysis.kline_decoder import decode_klines
+
+# rows concatenated before a chunk goes to the sink
+CHUNK_ROWS = 100000
+
+
+def fetch_pages(fetch, windows, executor, prefetch):
+    """
+    (window, page) of each window in the order of windows, with at most prefetch requests running or waiting to be
+    consumed so that a slow sink holds the downloads back instead of piling pages up in memory
+    """
+    windows = iter(windows)
+    pending = collections.deque((w, executor.submit(fetch, *w)) for w in itertools.islice(windows, prefetch))
+    while len(pending) > 0:
+        window, future = pending.popleft()
+        next_window = next(windows, None)
+        if next_window is not None:
+            pending.append((next_window, executor.submit(fetch, *next_window)))
+        yield window, future.result()
+
+
+def parse_pages(pages):
+    """
+    Typed candles of every page, which can be raw response bytes, already decoded candles or lists of klines, the pages
+    which failed (None) are dropped
+    """
+    for window, page in pages:
+        if page is None:
+            continue
+        if isinstance(page, bytes):
+            yield window, decode_klines(page)
+            continue
+        if isinstance(page, pd.DataFrame) and list(page.columns) == CANDLES_HEADER:
+            yield window, page
+            continue
+        data = pd.DataFrame(page)
+        if len(data) == 0:
+            yield window, empty_candles()
+            continue
+        data.columns = CANDLES_HEADER
+        yield window, data.astype(CANDLES_HEADER_TYPES)
+
+
+def drop_seen(frames, last_open_time=None):
+    """
+    Keeps the candles opened after the last one already seen, the frames have to come in open_time order
+    """
+    for window, data in frames:
+        if (last_open_time is not None) and len(data) > 0:
+            data = data[data['open_time'].values > last_open_time]
+        if len(data) > 0:
+            last_open_time = int(data['open_time'].values[-1])
+        yield window, data
+
+
+def batch_frames(frames, chunk_rows=CHUNK_ROWS):
+    """
+    Concatenates the frames into chunks of about chunk_rows rows, yields (windows, chunk)
+    """
+    windows, batch, rows = [], [], 0
+    for window, data in frames:
+        windows.append((window[0], window[1], len(data)))
+        if len(data) > 0:
+            batch.append(data)
+            rows += len(data)
+        if rows >= chunk_rows:
+            yield windows, pd.concat(batch, ignore_index=True)
+            windows, batch, rows = [], [], 0
+    if len(windows) > 0:
+        yield windows, pd.concat(batch, ignore_index=True) if len(batch) > 0 else empty_candles()
+
+
+def split_by_day(data):
+    """
+    (day, candles) of a chunk sorted by open_time in one pass over its rows
+    """
+    days = data['open_time'].values // DAY_MILLISECONDS
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]]) if len(days) > 0 else []
+    ends = list(starts[1:]) + [len(days)]
+    return [(int(days[st]), data.iloc[st:nd]) for st, nd in zip(starts, ends)]
+
+
+def run_pipeline(chunks, sink, manifest=None, symbol=None, interval=None):
+    """
+    Writes every chunk to the sink and marks its windows completed in the manifest once it is written, returns the
+    number of candles written
+    """
+    written = 0
+    for windows, data in chunks:
+        if len(data) > 0:
+            sink.write(data)
+            written += len(data)
+        if manifest is not None:
+            manifest.mark_completed(symbol, interval, windows)
+    return written
+
+
+class StoreSink:
+
+    def __init__(self, store, symbol, interval):
+        self.store = store
+        self.symbol = symbol
+        self.interval = interval
+
+    def write(self, data):
+        self.store.write(self.symbol, self.interval, data)
+
+
+class CsvSink:
+    """
+    Appends the chunks to one csv, the header is only written when the file is new
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+    def write(self, data):
+        exists = os.path.exists(self.file_name)
+        data.to_csv(self.file_name, index=False, mode='a' if exists else 'w', header=not exists)
+
+
+class DateCsvSink:
+    """
+    Appends the candles of each day to the {yyyymmdd}.csv of that day, in the layout of partition_by_date
+    """
+
+    def __init__(self, base_save_path, symbol):
+        self.base_save_path = base_save_path
+        self.symbol = symbol
+
+    def write(self, data):
+        for day, df_date in split_by_day(data):
+            df_date = df_date.assign(date=np.datetime64(day, 'D').astype(object), sym=self.symbol)
+            date_path = os.path.join(self.base_save_path, str(np.datetime64(day, 'D')).replace("-", "")) + ".csv"
+            CsvSink(date_path).write(df_date)
@@ -0,0 +1,158 @@
+import asyncio
+import os
+import threading
+import time
+
+import pandas as pd
+
+RATE_LIMITS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "exchange", "rateLimits.csv")
+INTERVAL_TO_SECONDS = {"SECOND": 1, "MINUTE": 60, "HOUR": 60 * 60, "DAY": 24 * 60 * 60}
+INTERVAL_TO_LETTER = {"SECOND": "s", "MINUTE": "m", "HOUR": "h", "DAY": "d"}
+# keep a bit of the budget free for requests which are already in flight when the headers come back
+SAFETY_MARGIN = 0.95
+MAX_BACKOFF = 5 * 60
+
+_shared_rate_limiter = None
+_shared_rate_limiter_lock = threading.Lock()
+
+
+class TokenBucket:
+
+    def __init__(self, limit, interval_seconds, header=None):
+        self.capacity = limit * SAFETY_MARGIN
+        self.rate = self.capacity / interval_seconds
+        self.header = header
+        self.tokens = self.capacity
+        self.in_flight = 0
+        self.last_refill = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def wait_time(self, cost):
+        if self.tokens >= cost:
+            return 0.
+        return (cost - self.tokens) / self.rate
+
+    def sync(self, used):
+        # the exchange counts the weight per ip, so this also picks up what other processes have used
+        self.tokens = min(self.capacity, self.capacity - used - self.in_flight)
+
+
+class RateLimiter:
+    """
+    Thread safe token bucket scheduler for the REQUEST_WEIGHT and RAW_REQUESTS limits of
+    https://binance-docs.github.io/apidocs/spot/en/#limits
+
+    The buckets are synced with the X-MBX-USED-WEIGHT-(intervalNum)(intervalLetter) headers of every response and
+    all requests are paused after a 429 or a 418 until the Retry-After has passed.
+    """
+
+    def __init__(self, rate_limits):
+        if isinstance(rate_limits, pd.DataFrame):
+            rate_limits = rate_limits.to_dict('records')
+        self.lock = threading.Lock()
+        self.weight_buckets = []
+        self.request_buckets = []
+        self.blocked_until = 0.
+        self.backoffs = 0
+
+        for rate_limit in rate_limits:
+            interval_seconds = INTERVAL_TO_SECONDS[rate_limit['interval']] * int(rate_limit['intervalNum'])
+            if rate_limit['rateLimitType'] == 'REQUEST_WEIGHT':
+                header = f"x-mbx-used-weight-{rate_limit['intervalNum']}" \
+                         f"{INTERVAL_TO_LETTER[rate_limit['interval']]}"
+                self.weight_buckets.append(TokenBucket(int(rate_limit['limit']), interval_seconds, header))
+            elif rate_limit['rateLimitType'] == 'RAW_REQUESTS':
+                self.request_buckets.append(TokenBucket(int(rate_limit['limit']), interval_seconds))
+
+    @classmethod
+    def from_csv(cls, path=RATE_LIMITS_PATH):
+        return cls(pd.read_csv(path, index_col=0))
+
+    def _costs(self, weight):
+        return [(bucket, weight) for bucket in self.weight_buckets] + [(bucket, 1) for bucket in self.request_buckets]
+
+    def reserve(self, weight=1):
+        """
+        Takes the weight out of the buckets if the budget allows it and returns 0, otherwise returns the number of
+        seconds to wait before trying again
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+
+            costs = self._costs(weight)
+            wait = 0.
+            for bucket, cost in costs:
+                bucket.refill(now)
+                wait = max(wait, bucket.wait_time(cost))
+            if wait > 0:
+                return wait
+
+            for bucket, cost in costs:
+                bucket.tokens -= cost
+                bucket.in_flight += cost
+            return 0.
+
+    def acquire(self, weight=1):
+        while True:
+            wait = self.reserve(weight)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, weight=1):
+        while True:
+            wait = self.reserve(weight)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def release(self, weight=1, headers=None, status_code=None):
+        with self.lock:
+            for bucket, cost in self._costs(weight):
+                bucket.in_flight -= cost
+
+            if headers is not None:
+                for bucket in self.weight_buckets:
+                    used = headers.get(bucket.header)
+                    if used is not None:
+                        bucket.sync(int(used))
+
+            if status_code in (418, 429):
+                retry_after = None if headers is None else headers.get('retry-after')
+                self._backoff(None if retry_after is None else int(retry_after))
+            elif status_code is not None:
+                self.backoffs = 0
+
+    def _backoff(self, retry_after=None):
+        if retry_after is None:
+            retry_after = min(MAX_BACKOFF, 2 ** self.backoffs)
+        self.backoffs += 1
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        for bucket in self.weight_buckets + self.request_buckets:
+            bucket.tokens = min(bucket.tokens, 0)
+        print(f"Rate limit hit, backing off for {retry_after} seconds")
+
+
+def get_rate_limiter():
+    """
+    One rate limiter shared by every requester of the process
+    """
+    global _shared_rate_limiter
+    with _shared_rate_limiter_lock:
+        if _shared_rate_limiter is None:
+            _shared_rate_limiter = RateLimiter.from_csv()
+        return _shared_rate_limiter
+
+
+def set_rate_limiter(rate_limiter):
+    """
+    Replaces the shared rate limiter, e.g. with one built from get_exchange_info(get_all=True, get_rate_limit=True)
+    """
+    global _shared_rate_limiter
+    with _shared_rate_limiter_lock:
+        _shared_rate_limiter = rate_limiter
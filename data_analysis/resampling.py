@@ -0,0 +1,146 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_analysis.candle_store import DAY_MILLISECONDS
+from data_analysis.constants import CANDLES_HEADER, CANDLES_HEADER_TYPES, VALID_INTERVALS, VALID_INTERVALS_TO_TIME
+
+# 1970-01-01 was a Thursday and the weekly candles open on Mondays
+WEEK_OFFSET = 4 * DAY_MILLISECONDS
+FIRST_COLUMNS = ['open', 'ignore']
+LAST_COLUMNS = ['close']
+MAX_COLUMNS = ['high']
+MIN_COLUMNS = ['low']
+SUM_COLUMNS = ['volume', 'quote_asset_volume', 'number_of_trades', 'taker_buy_base_asset_volume',
+               'taker_buy_quote_asset_volume']
+
+
+def interval_open_times(open_time, interval):
+    """
+    Open time of the interval candle each open_time falls in
+    """
+    open_time = np.asarray(open_time, dtype=np.int64)
+    if interval == '1M':
+        months = open_time.astype('datetime64[ms]').astype('datetime64[M]')
+        return months.astype('datetime64[ms]').astype(np.int64)
+    interval_milliseconds = VALID_INTERVALS_TO_TIME[interval]
+    offset = WEEK_OFFSET if interval == '1w' else 0
+    return (open_time - offset) // interval_milliseconds * interval_milliseconds + offset
+
+
+def interval_close_times(open_time, interval):
+    open_time = np.asarray(open_time, dtype=np.int64)
+    if interval == '1M':
+        months = open_time.astype('datetime64[ms]').astype('datetime64[M]') + 1
+        return months.astype('datetime64[ms]').astype(np.int64) - 1
+    return open_time + VALID_INTERVALS_TO_TIME[interval] - 1
+
+
+def resample_candles(data, interval, bins=None, return_counts=False):
+    """
+    Builds the interval candles out of finer ones sorted by open_time with one reduceat per column.
+    The candles are grouped by interval_open_times unless bins, the sorted open times of the target candles, are given.
+    """
+    if interval not in VALID_INTERVALS:
+        raise ValueError("Invalid Interval")
+
+    open_time = np.asarray(data['open_time'], dtype=np.int64)
+    if bins is None:
+        keys = interval_open_times(open_time, interval)
+        rows = np.arange(len(open_time))
+    else:
+        bins = np.asarray(bins, dtype=np.int64)
+        groups = np.searchsorted(bins, open_time, side='right') - 1
+        rows = np.flatnonzero(groups >= 0)
+        keys = bins[groups[rows]]
+
+    if len(rows) == 0:
+        result = pd.DataFrame({c: pd.Series(dtype=CANDLES_HEADER_TYPES[c]) for c in CANDLES_HEADER})
+        return (result, np.empty(0, dtype=np.int64)) if return_counts else result
+
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)] - 1
+    bar_open_time = keys[starts]
+
+    result = {'open_time': bar_open_time}
+    for column in CANDLES_HEADER[1:]:
+        if column == 'close_time':
+            result[column] = interval_close_times(bar_open_time, interval)
+            continue
+        values = np.asarray(data[column])[rows]
+        if column in FIRST_COLUMNS:
+            result[column] = values[starts]
+        elif column in LAST_COLUMNS:
+            result[column] = values[ends]
+        elif column in MAX_COLUMNS:
+            result[column] = np.maximum.reduceat(values, starts)
+        elif column in MIN_COLUMNS:
+            result[column] = np.minimum.reduceat(values, starts)
+        else:
+            result[column] = np.add.reduceat(values, starts)
+
+    result = pd.DataFrame(result)[CANDLES_HEADER].astype(CANDLES_HEADER_TYPES)
+    if return_counts:
+        return result, ends - starts + 1
+    return result
+
+
+def compare_candles(expected, derived):
+    """
+    Mismatch report between candles, one row per (open_time, field) which does not match and a 'missing' row for
+    every expected candle that could not be derived
+    """
+    expected_time = np.asarray(expected['open_time'], dtype=np.int64)
+    derived_time = np.asarray(derived['open_time'], dtype=np.int64)
+    common, expected_rows, derived_rows = np.intersect1d(expected_time, derived_time, assume_unique=True,
+                                                         return_indices=True)
+
+    reports = []
+    missing = np.setdiff1d(expected_time, common, assume_unique=True)
+    if len(missing) > 0:
+        reports.append(pd.DataFrame({'open_time': missing, 'field': 'missing', 'expected': np.nan,
+                                     'derived': np.nan}))
+
+    for column in FIRST_COLUMNS[:1] + LAST_COLUMNS + MAX_COLUMNS + MIN_COLUMNS + SUM_COLUMNS:
+        expected_values = np.asarray(expected[column], dtype=np.float64)[expected_rows]
+        derived_values = np.asarray(derived[column], dtype=np.float64)[derived_rows]
+        if column in SUM_COLUMNS:
+            wrong = ~np.isclose(expected_values, derived_values)
+        else:
+            wrong = expected_values != derived_values
+        if wrong.any():
+            reports.append(pd.DataFrame({'open_time': common[wrong], 'field': column,
+                                         'expected': expected_values[wrong], 'derived': derived_values[wrong]}))
+
+    if len(reports) == 0:
+        return pd.DataFrame({'open_time': pd.Series(dtype=np.int64), 'field': pd.Series(dtype=object),
+                             'expected': pd.Series(dtype=np.float64), 'derived': pd.Series(dtype=np.float64)})
+    return pd.concat(reports, ignore_index=True).sort_values(by=['open_time', 'field'], ignore_index=True)
+
+
+def derive_store_intervals(store, symbol, intervals, source_interval='1m'):
+    """
+    Writes the coarser intervals of a symbol to the store from its source_interval candles instead of downloading them.
+    Each interval is only derived from its last stored bar onward and the bar still open at the end of the source is
+    left out, so running it again after an update only appends the new closed bars.
+    """
+    intervals = [i for i in intervals if VALID_INTERVALS_TO_TIME[i] > VALID_INTERVALS_TO_TIME[source_interval]]
+    if len(intervals) == 0:
+        return
+    last_open_times = {i: store.last_open_time(symbol, i) for i in intervals}
+    starts = list(last_open_times.values())
+    start = None if any(s is None for s in starts) else min(starts)
+    source = store.read(symbol, source_interval, start)
+    if len(source) == 0:
+        return
+    # a bar is closed once the source covers it up to its close_time and the clock is past it
+    closed_until = min(int(source['close_time'].values[-1]), int(time.time() * 1000))
+    for interval in intervals:
+        last_open_time = last_open_times[interval]
+        data = source if last_open_time is None else source[source['open_time'].values >= last_open_time]
+        derived = resample_candles(data, interval)
+        derived = derived[derived['close_time'].values <= closed_until]
+        # the last stored bar is written again with the new ones in case it was stored before it closed
+        if (len(derived) > 0) and ((last_open_time is None) or (derived['open_time'].values[-1] > last_open_time)):
+            store.write(symbol, interval, derived)
@@ -0,0 +1,126 @@
+import hashlib
+import os
+import time
+
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+OPEN_RANGE_TTL = 60
+# share of max_bytes written by a process before it checks the size of the cache again
+EVICTION_CHECK = 0.05
+EVICTION_TARGET = 0.9
+CLOSED_SUFFIX = ".closed"
+OPEN_SUFFIX = ".open"
+
+
+def url_key(url):
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    On disk cache of raw REST responses keyed by the sha256 of the request url, laid out as
+    {base_path}/{key[:2]}/{key}{suffix} so several processes can share it through atomic renames.
+
+    Responses of closed ranges never change and are kept until evicted, the ones of open ranges expire after open_ttl
+    seconds. The least recently read entries are evicted once the cache grows over max_bytes, reads refresh the
+    access time of the file.
+    """
+
+    def __init__(self, base_path, max_bytes=MAX_CACHE_BYTES, open_ttl=OPEN_RANGE_TTL):
+        self.base_path = base_path
+        self.max_bytes = max_bytes
+        self.open_ttl = open_ttl
+        self.written = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key, suffix):
+        return os.path.join(self.base_path, key[:2], key + suffix)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'rb') as handle:
+                content = handle.read()
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+        except FileNotFoundError:
+            # evicted by another process in between
+            return None
+        return content
+
+    def get(self, url):
+        key = url_key(url)
+        content = self._read(self._path(key, CLOSED_SUFFIX))
+        if content is None:
+            path = self._path(key, OPEN_SUFFIX)
+            if os.path.exists(path) and (time.time() - os.path.getmtime(path) < self.open_ttl):
+                content = self._read(path)
+        if content is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return content
+
+    def put(self, url, content, closed):
+        path = self._path(url_key(url), CLOSED_SUFFIX if closed else OPEN_SUFFIX)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as handle:
+            handle.write(content)
+        os.replace(tmp_path, path)
+        self.written += len(content)
+        if self.written >= self.max_bytes * EVICTION_CHECK:
+            self.written = 0
+            self.evict()
+
+    def entries(self):
+        """
+        (atime, size, path, mtime) of every entry
+        """
+        entries = []
+        for root, _, files in os.walk(self.base_path):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path, stat.st_mtime))
+        return entries
+
+    def size(self):
+        return sum(entry[1] for entry in self.entries())
+
+    def evict(self):
+        """
+        Removes the expired open entries and then the least recently read ones until the cache is under
+        EVICTION_TARGET of max_bytes, returns the number of removed entries
+        """
+        entries = self.entries()
+        now = time.time()
+        removed = 0
+        kept = []
+        for atime, size, path, mtime in entries:
+            if path.endswith(OPEN_SUFFIX) and (now - mtime >= self.open_ttl):
+                removed += self._remove(path)
+            else:
+                kept.append((atime, size, path))
+
+        total = sum(size for _, size, _ in kept)
+        if total <= self.max_bytes:
+            return removed
+        for _, size, path in sorted(kept):
+            if total <= self.max_bytes * EVICTION_TARGET:
+                break
+            removed += self._remove(path)
+            total -= size
+        return removed
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return 1
+        except FileNotFoundError:
+            return 0
@@ -0,0 +1,287 @@
+import glob
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import websocket
+
+from streams.kline_stream import BASE, get_logger
+
+# binance accepts up to 1024 streams per connection, fewer keeps a reconnect cheap
+STREAMS_PER_CONNECTION = 200
+BUFFER_SIZE = 1_000_000
+FLUSH_ROWS = 10_000
+FLUSH_SECONDS = 1.0
+MAX_RECONNECT_WAIT = 60
+PING_INTERVAL = 60
+DAY_MILLISECONDS = 24 * 60 * 60 * 1000
+
+AGG_TRADE_DTYPE = np.dtype([('symbol_id', '<i4'), ('event_time', '<i8'), ('agg_trade_id', '<i8'), ('price', '<f8'),
+                            ('quantity', '<f8'), ('first_trade_id', '<i8'), ('last_trade_id', '<i8'),
+                            ('trade_time', '<i8'), ('is_buyer_maker', '?')])
+AGG_TRADE_COLUMNS = ['symbol', 'event_time', 'agg_trade_id', 'price', 'quantity', 'first_trade_id', 'last_trade_id',
+                     'trade_time', 'is_buyer_maker']
+
+
+class TradeRingBuffer:
+    """
+    Fixed size buffer of AGG_TRADE_DTYPE records, when the sink falls behind the oldest trades are overwritten and
+    counted in dropped instead of growing without bound
+    """
+
+    def __init__(self, capacity=BUFFER_SIZE):
+        self.records = np.zeros(capacity, dtype=AGG_TRADE_DTYPE)
+        self.capacity = capacity
+        self.start = 0
+        self.size = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def append(self, record):
+        with self.lock:
+            self.records[(self.start + self.size) % self.capacity] = record
+            if self.size == self.capacity:
+                self.start = (self.start + 1) % self.capacity
+                self.dropped += 1
+            else:
+                self.size += 1
+            return self.size
+
+    def drain(self):
+        with self.lock:
+            end = self.start + self.size
+            if end <= self.capacity:
+                records = self.records[self.start:end].copy()
+            else:
+                records = np.concatenate([self.records[self.start:], self.records[:end - self.capacity]])
+            self.start = 0
+            self.size = 0
+        return records
+
+
+def records_to_frame(records, symbols):
+    data = pd.DataFrame({c: records[c] for c in AGG_TRADE_DTYPE.names[1:]})
+    data.insert(0, 'symbol', np.asarray(symbols, dtype=object)[records['symbol_id']])
+    return data
+
+
+class TickStoreSink:
+    """
+    Local columnar tick store, every flush adds {base_path}/{symbol}/aggTrade/{yyyymmdd}-{segment}.parquet files so
+    nothing already written is touched
+    """
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+
+    def _path(self, symbol, day, segment):
+        day = str(np.datetime64(int(day), 'D')).replace("-", "")
+        return os.path.join(self.base_path, symbol, "aggTrade", f"{day}-{segment}.parquet")
+
+    def write(self, data):
+        segment = time.time_ns()
+        for (symbol, day), df_day in data.groupby([data['symbol'], data['trade_time'].values // DAY_MILLISECONDS]):
+            path = self._path(symbol, day, segment)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            df_day.drop(columns='symbol').to_parquet(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
+
+    def read(self, symbol, day=None):
+        day = "*" if day is None else str(np.datetime64(day, 'D')).replace("-", "")
+        paths = sorted(glob.glob(os.path.join(self.base_path, symbol, "aggTrade", f"{day}-*.parquet")))
+        if len(paths) == 0:
+            return pd.DataFrame(columns=AGG_TRADE_COLUMNS[1:])
+        data = pd.concat([pd.read_parquet(p) for p in paths], ignore_index=True)
+        return data.sort_values(by='agg_trade_id', kind='stable').drop_duplicates(subset='agg_trade_id', keep='last')
+
+
+class KdbSink:
+    """
+    Inserts every micro-batch into a kdb+ table through qpython with one asynchronous message
+    """
+
+    def __init__(self, host='localhost', port=5000, table='trade'):
+        from qpython import qconnection
+
+        self.table = table
+        self.connection = qconnection.QConnection(host=host, port=port, pandas=True)
+        self.connection.open()
+
+    def write(self, data):
+        self.connection.sendAsync("insert", np.string_(self.table), data)
+
+    def close(self):
+        self.connection.close()
+
+
+def write_batches(sink, batches):
+    """
+    Writes the batches in order until one fails, returns the ones left from the failed one and the error
+    """
+    for i, data in enumerate(batches):
+        try:
+            sink.write(data)
+        except Exception as err:
+            return batches[i:], err
+    return [], None
+
+
+def cap_batches(batches, max_rows):
+    """
+    Keeps at most max_rows trades of the batches, the oldest ones go first, returns them with the dropped count
+    """
+    rows = sum(len(data) for data in batches)
+    batches = list(batches)
+    dropped = 0
+    while rows - dropped > max_rows:
+        data = batches[0]
+        if rows - dropped - len(data) >= max_rows:
+            batches.pop(0)
+            dropped += len(data)
+        else:
+            cut = rows - dropped - max_rows
+            batches[0] = data.iloc[cut:]
+            dropped += cut
+    return batches, dropped
+
+
+class MultiSink:
+    """
+    Writes every micro-batch to each of the sinks, e.g. the tick store and a KlineAggregator. The batches a sink
+    failed to take are kept for that sink alone, up to max_rows trades, and written to it before the next batch, so
+    the sinks which took them never get them twice. Failures are handled here and never raised to the caller.
+    """
+
+    def __init__(self, *sinks, max_rows=BUFFER_SIZE, logger=None):
+        self.sinks = sinks
+        self.pending = [[] for _ in sinks]
+        self.max_rows = max_rows
+        self.dropped = 0
+        self.logger = get_logger("multi_sink") if logger is None else logger
+
+    def write(self, data):
+        for i, sink in enumerate(self.sinks):
+            batches, err = write_batches(sink, self.pending[i] + [data])
+            if err is not None:
+                self.logger.error(f"could not write {sum(len(b) for b in batches)} trades to "
+                                  f"{type(sink).__name__}: {err}")
+            self.pending[i], dropped = cap_batches(batches, self.max_rows)
+            if dropped > 0:
+                self.dropped += dropped
+                self.logger.warning(f"{dropped} trades dropped for {type(sink).__name__}, it is down")
+
+
+class AggTradeIngestor:
+    """
+    Listens to the aggTrade stream of many symbols over combined stream connections, the messages are decoded into a
+    ring buffer which a flusher thread writes to the sink every FLUSH_ROWS trades or FLUSH_SECONDS, whichever comes
+    first. Dropped connections are reopened with the same streams after an exponential backoff. Batches the sink
+    failed to take are retried on the next flush, up to buffer_size trades, beyond which the oldest are dropped like
+    the ones of the ring buffer.
+    """
+
+    def __init__(self, symbols, sink, logger=None, flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS,
+                 buffer_size=BUFFER_SIZE):
+        self.symbols = [s.upper() for s in symbols]
+        self.symbol_ids = {s: i for i, s in enumerate(self.symbols)}
+        self.sink = sink
+        self.logger = get_logger("agg_trade_stream") if logger is None else logger
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.buffer = TradeRingBuffer(buffer_size)
+        self.flush_event = threading.Event()
+        self.stopped = threading.Event()
+        self.sockets = {}
+        self.threads = []
+        self.failed_batches = []
+        self.failed_rows = buffer_size
+        self.reported_dropped = 0
+
+    def stream_urls(self):
+        streams = [f"{s.lower()}@aggTrade" for s in self.symbols]
+        return [BASE + "/stream?streams=" + "/".join(streams[i:i + STREAMS_PER_CONNECTION])
+                for i in range(0, len(streams), STREAMS_PER_CONNECTION)]
+
+    def on_message(self, ws, message):
+        try:
+            trade = json.loads(message)['data']
+            size = self.buffer.append((self.symbol_ids[trade['s']], trade['E'], trade['a'], float(trade['p']),
+                                       float(trade['q']), trade['f'], trade['l'], trade['T'], trade['m']))
+        except Exception as err:
+            self.logger.error(f"could not decode {message[:200]}: {err}")
+            return
+        if size >= self.flush_rows:
+            self.flush_event.set()
+
+    def flush(self):
+        records = self.buffer.drain()
+        batches = self.failed_batches + ([records_to_frame(records, self.symbols)] if len(records) > 0 else [])
+        # kept for the next flush so that a sink which is briefly down loses nothing
+        batches, err = write_batches(self.sink, batches)
+        if err is not None:
+            self.logger.error(f"could not write {sum(len(b) for b in batches)} trades: {err}")
+        self.failed_batches, dropped = cap_batches(batches, self.failed_rows)
+        if dropped > 0:
+            with self.buffer.lock:
+                self.buffer.dropped += dropped
+        if self.buffer.dropped > self.reported_dropped:
+            self.logger.warning(f"{self.buffer.dropped - self.reported_dropped} trades dropped, the sink is too slow "
+                                f"or down")
+            self.reported_dropped = self.buffer.dropped
+
+    def _flush_loop(self):
+        while not self.stopped.is_set():
+            self.flush_event.wait(self.flush_seconds)
+            self.flush_event.clear()
+            self.flush()
+        self.flush()
+
+    def _connection_loop(self, url):
+        wait = 1
+        while not self.stopped.is_set():
+            opened = threading.Event()
+            ws = websocket.WebSocketApp(url, on_open=lambda ws: opened.set(), on_message=self.on_message,
+                                        on_error=lambda ws, err: self.logger.error(f"{url[:80]}: {err}"))
+            self.sockets[url] = ws
+            self.logger.info(f"connecting {url[:80]}")
+            ws.run_forever(ping_interval=PING_INTERVAL)
+            if self.stopped.is_set():
+                break
+            wait = 1 if opened.is_set() else min(wait * 2, MAX_RECONNECT_WAIT)
+            self.logger.warning(f"connection closed, reconnecting in {wait} seconds")
+            self.stopped.wait(wait)
+
+    def start(self):
+        self.stopped.clear()
+        self.threads = [threading.Thread(target=self._flush_loop, daemon=True)]
+        self.threads += [threading.Thread(target=self._connection_loop, args=(url,), daemon=True)
+                         for url in self.stream_urls()]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.flush_event.set()
+        for ws in list(self.sockets.values()):
+            ws.close()
+        for thread in self.threads:
+            thread.join()
+
+    def run_forever(self):
+        self.start()
+        try:
+            while not self.stopped.is_set():
+                self.stopped.wait(1)
+        except KeyboardInterrupt:
+            self.stop()
+
+
+if __name__ == "__main__":
+    ingestor = AggTradeIngestor(["BTCUSDT", "ETHUSDT", "BNBUSDT"], TickStoreSink(r"D:\crypto\data\ticks"))
+    ingestor.run_forever()
@@ -0,0 +1,188 @@
+import collections
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_analysis.constants import CANDLES_HEADER, CANDLES_HEADER_TYPES, VALID_INTERVALS
+from data_analysis.resampling import interval_close_times, interval_open_times
+
+STORE_FLUSH_SECONDS = 60
+# open_time, open, high, low, close, volume, close_time, quote volume, trades, taker buy base, taker buy quote, ignore
+OPEN, HIGH, LOW, CLOSE, VOLUME, CLOSE_TIME, QUOTE_VOLUME, TRADES, TAKER_BASE, TAKER_QUOTE = range(1, 11)
+
+
+def empty_bars(open_times, interval, price):
+    """
+    Candles of the intervals without trades, flat at the last close like the ones of the klines endpoint
+    """
+    close_times = interval_close_times(open_times, interval)
+    return [[int(o), price, price, price, price, 0.0, int(c), 0.0, 0, 0.0, 0.0, 0.0]
+            for o, c in zip(open_times, close_times)]
+
+
+def skipped_open_times(last_open_time, next_open_time, interval):
+    if interval == '1M':
+        months = np.arange(np.datetime64(last_open_time, 'ms').astype('datetime64[M]') + 1,
+                           np.datetime64(next_open_time, 'ms').astype('datetime64[M]'))
+        return months.astype('datetime64[ms]').astype(np.int64)
+    step = int(interval_close_times([0], interval)[0]) + 1
+    return np.arange(last_open_time + step, next_open_time, step)
+
+
+class KlineAggregator:
+    """
+    Builds the candles of every interval from aggTrades as they arrive, each trade updates the open bar of each
+    interval in O(1) and a bar is closed once a trade or the clock passes its close_time.
+
+    Closed candles have the CANDLES_HEADER schema and go to the callbacks straight away and to the store every
+    store_flush_seconds. The first bar of each series is dropped as the trades before the start are missing from it.
+    It can be used as the sink of an AggTradeIngestor, trades at or below the last applied trade id of their symbol
+    are skipped so that a batch written again after a failure is only counted once.
+    """
+
+    def __init__(self, intervals=VALID_INTERVALS, store=None, callbacks=None, store_flush_seconds=STORE_FLUSH_SECONDS,
+                 emit_partial=False):
+        self.intervals = list(intervals)
+        self.store = store
+        self.callbacks = [] if callbacks is None else list(callbacks)
+        self.store_flush_seconds = store_flush_seconds
+        self.emit_partial = emit_partial
+        # (symbol, interval) -> open bar as a list in the CANDLES_HEADER order
+        self.bars = {}
+        # (symbol, interval) -> (open_time, close_time, close) of the last closed bar
+        self.last_closed = {}
+        self.partial = set()
+        self.closed = collections.defaultdict(list)
+        self.last_store_flush = time.time()
+        self.late_trades = 0
+        # symbol -> last_trade_id of the last applied trade
+        self.last_trade_ids = {}
+        self.duplicate_trades = 0
+
+    def _fill(self, key, next_open_time):
+        last = self.last_closed.get(key)
+        if last is None:
+            return
+        skipped = skipped_open_times(last[0], next_open_time, key[1])
+        if len(skipped) > 0:
+            bars = empty_bars(skipped, key[1], last[2])
+            self.last_closed[key] = (bars[-1][0], bars[-1][CLOSE_TIME], last[2])
+            self._emit(key, bars)
+
+    def _open_bar(self, key, trade_time, price):
+        interval = key[1]
+        open_time = int(interval_open_times([trade_time], interval)[0])
+        close_time = int(interval_close_times([open_time], interval)[0])
+        if key in self.last_closed:
+            self._fill(key, open_time)
+        elif not self.emit_partial:
+            self.partial.add(key)
+        bar = [open_time, price, price, price, price, 0.0, close_time, 0.0, 0, 0.0, 0.0, 0.0]
+        self.bars[key] = bar
+        return bar
+
+    def _close_bar(self, key):
+        bar = self.bars.pop(key)
+        self.last_closed[key] = (bar[0], bar[CLOSE_TIME], bar[CLOSE])
+        if key in self.partial:
+            self.partial.discard(key)
+            return
+        self._emit(key, [bar])
+
+    def _emit(self, key, bars):
+        self.closed[key].extend(bars)
+        for callback in self.callbacks:
+            callback(key[0], key[1], bars)
+
+    def on_trade(self, symbol, price, quantity, trade_time, is_buyer_maker, first_trade_id, last_trade_id):
+        if last_trade_id <= self.last_trade_ids.get(symbol, -1):
+            self.duplicate_trades += 1
+            return
+        self.last_trade_ids[symbol] = last_trade_id
+        quote = price * quantity
+        trades = last_trade_id - first_trade_id + 1
+        for interval in self.intervals:
+            key = (symbol, interval)
+            bar = self.bars.get(key)
+            if (bar is not None) and (trade_time > bar[CLOSE_TIME]):
+                self._close_bar(key)
+                bar = None
+            if bar is None:
+                last = self.last_closed.get(key)
+                if (last is not None) and (trade_time <= last[1]):
+                    self.late_trades += 1
+                    continue
+                bar = self._open_bar(key, trade_time, price)
+            elif trade_time < bar[0]:
+                self.late_trades += 1
+                continue
+            if price > bar[HIGH]:
+                bar[HIGH] = price
+            if price < bar[LOW]:
+                bar[LOW] = price
+            bar[CLOSE] = price
+            bar[VOLUME] += quantity
+            bar[QUOTE_VOLUME] += quote
+            bar[TRADES] += trades
+            # the buyer is the taker when it is not the maker
+            if not is_buyer_maker:
+                bar[TAKER_BASE] += quantity
+                bar[TAKER_QUOTE] += quote
+
+    def close_due(self, now_ms):
+        """
+        Closes the bars whose close_time is before now_ms and adds the empty candles of the intervals which ended
+        without trades, so that quiet symbols still get their candles on time
+        """
+        for key in [k for k, bar in self.bars.items() if bar[CLOSE_TIME] < now_ms]:
+            self._close_bar(key)
+        for key in [k for k in self.last_closed if k not in self.bars]:
+            self._fill(key, int(interval_open_times([now_ms], key[1])[0]))
+
+    def write(self, data):
+        """
+        Sink interface of AggTradeIngestor, data is one micro-batch of trades. The bars are closed by the exchange
+        event time rather than the local clock, so a skewed clock does not close them early.
+        """
+        if len(data) == 0:
+            return
+        for row in zip(data['symbol'].values, data['price'].values, data['quantity'].values,
+                       data['trade_time'].values, data['is_buyer_maker'].values, data['first_trade_id'].values,
+                       data['last_trade_id'].values):
+            self.on_trade(row[0], float(row[1]), float(row[2]), int(row[3]), bool(row[4]), int(row[5]), int(row[6]))
+        self.close_due(int(data['event_time'].values.max()))
+        if time.time() - self.last_store_flush >= self.store_flush_seconds:
+            self.flush()
+
+    def candles(self, symbol, interval):
+        """
+        Closed candles which were not flushed to the store yet
+        """
+        bars = self.closed.get((symbol, interval), [])
+        return pd.DataFrame(bars, columns=CANDLES_HEADER).astype(CANDLES_HEADER_TYPES)
+
+    def flush(self):
+        """
+        Writes the closed candles to the store, the ones of a series are only dropped once they are written so a
+        failing store keeps them for the next flush
+        """
+        self.last_store_flush = time.time()
+        if self.store is None:
+            self.closed = collections.defaultdict(list)
+            return
+        for key in list(self.closed):
+            self.store.write(key[0], key[1], pd.DataFrame(self.closed[key], columns=CANDLES_HEADER))
+            del self.closed[key]
+
+
+if __name__ == "__main__":
+    from data_analysis.indicators import LiveIndicators
+    from streams.agg_trade_stream import AggTradeIngestor
+
+    def print_signal(symbol, interval, bar, values):
+        if values['ewma_cross']['signal'] != 0:
+            print(symbol, interval, bar[0], values)
+
+    aggregator = KlineAggregator(['1m', '5m'], callbacks=[LiveIndicators(on_update=print_signal)])
+    AggTradeIngestor(["BTCUSDT", "ETHUSDT"], aggregator).run_forever()
@@ -10,7 +10,7 @@ import json
 from logging.handlers import TimedRotatingFileHandler
 
 FORMATTER = logging.Formatter("%(asctime)s — %(name)s — %(levelname)s — %(funcName)s:%(lineno)d — %(message)s")
-LOG_BASE = os.path.join(__file__, "..", "..", "logs")
+LOG_BASE = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "logs"))
 BASE = "wss://stream.binance.com:9443"
 
 
@@ -21,6 +21,7 @@ def get_console_handler():
 
 
 def get_file_handler(log_filename):
+    os.makedirs(LOG_BASE, exist_ok=True)
     file_handler = TimedRotatingFileHandler(os.path.join(LOG_BASE, log_filename + '.log'), when='midnight')
     file_handler.setFormatter(FORMATTER)
     return file_handler
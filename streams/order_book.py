@@ -0,0 +1,275 @@
+import bisect
+import json
+import threading
+import time
+
+import numpy as np
+import websocket
+
+from data_analysis.data_getter import DataGetterSymbol
+from streams.agg_trade_stream import MAX_RECONNECT_WAIT, PING_INTERVAL, STREAMS_PER_CONNECTION
+from streams.kline_stream import BASE, get_logger
+
+SNAPSHOT_LIMIT = 1000
+# events kept per symbol while its snapshot is being downloaded
+MAX_BUFFERED_EVENTS = 10000
+# seconds before the first retry of a failed snapshot, doubled by each failure up to MAX_RECONNECT_WAIT
+SNAPSHOT_RETRY_WAIT = 1
+
+
+class BookSide:
+    """
+    Price levels of one side kept sorted in flat lists, best level first. Bids are keyed by -price so that both sides
+    are ascending and bisect finds a level in O(log n).
+    """
+
+    def __init__(self, is_bid):
+        self.sign = -1.0 if is_bid else 1.0
+        self.keys = []
+        self.quantities = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def clear(self):
+        self.keys = []
+        self.quantities = []
+
+    def update(self, price, quantity):
+        key = self.sign * price
+        i = bisect.bisect_left(self.keys, key)
+        found = (i < len(self.keys)) and (self.keys[i] == key)
+        if quantity == 0:
+            if found:
+                del self.keys[i]
+                del self.quantities[i]
+        elif found:
+            self.quantities[i] = quantity
+        else:
+            self.keys.insert(i, key)
+            self.quantities.insert(i, quantity)
+
+    def best(self):
+        if len(self.keys) == 0:
+            return None, None
+        return self.sign * self.keys[0], self.quantities[0]
+
+    def quantity_at(self, price):
+        key = self.sign * price
+        i = bisect.bisect_left(self.keys, key)
+        if (i < len(self.keys)) and (self.keys[i] == key):
+            return self.quantities[i]
+        return 0.0
+
+    def levels(self, n=None):
+        """
+        (prices, quantities) of the n best levels as arrays
+        """
+        n = len(self.keys) if n is None else n
+        return self.sign * np.array(self.keys[:n]), np.array(self.quantities[:n])
+
+    def volume_to_price(self, price):
+        """
+        Quantity of the levels from the best one up to price included
+        """
+        i = bisect.bisect_right(self.keys, self.sign * price)
+        return float(np.sum(self.quantities[:i]))
+
+    def price_for_volume(self, volume):
+        """
+        Worst price reached when volume is taken from this side, None if the book is not deep enough
+        """
+        cumulative = np.cumsum(self.quantities)
+        i = int(np.searchsorted(cumulative, volume, side='left'))
+        if i >= len(cumulative):
+            return None
+        return self.sign * self.keys[i]
+
+
+class LocalOrderBook:
+    """
+    Order book of a symbol rebuilt from a REST snapshot and the @depth diff events which follow it, following
+    https://binance-docs.github.io/apidocs/spot/en/#how-to-manage-a-local-order-book-correctly
+
+    An event which does not continue the last applied one leaves the book unsynced until the next snapshot.
+    """
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.bids = BookSide(is_bid=True)
+        self.asks = BookSide(is_bid=False)
+        self.last_update_id = None
+        self.synced = False
+        self.first_event = True
+
+    def apply_snapshot(self, snapshot):
+        self.bids.clear()
+        self.asks.clear()
+        for price, quantity in snapshot['bids']:
+            self.bids.update(float(price), float(quantity))
+        for price, quantity in snapshot['asks']:
+            self.asks.update(float(price), float(quantity))
+        self.last_update_id = snapshot['lastUpdateId']
+        self.synced = True
+        self.first_event = True
+
+    def apply_event(self, event):
+        """
+        Applies a depthUpdate event, returns False when the book is out of sync and needs a new snapshot
+        """
+        if not self.synced:
+            return False
+        if event['u'] <= self.last_update_id:
+            # already part of the snapshot
+            return True
+        if self.first_event:
+            in_sequence = event['U'] <= self.last_update_id + 1 <= event['u']
+        else:
+            in_sequence = event['U'] == self.last_update_id + 1
+        if not in_sequence:
+            self.synced = False
+            return False
+        for price, quantity in event['b']:
+            self.bids.update(float(price), float(quantity))
+        for price, quantity in event['a']:
+            self.asks.update(float(price), float(quantity))
+        self.last_update_id = event['u']
+        self.first_event = False
+        return True
+
+    def best_bid(self):
+        return self.bids.best()
+
+    def best_ask(self):
+        return self.asks.best()
+
+    def mid_price(self):
+        bid, ask = self.bids.best()[0], self.asks.best()[0]
+        if (bid is None) or (ask is None):
+            return None
+        return (bid + ask) / 2
+
+    def spread(self):
+        bid, ask = self.bids.best()[0], self.asks.best()[0]
+        if (bid is None) or (ask is None):
+            return None
+        return ask - bid
+
+    def quantity_at(self, price):
+        """
+        Quantity resting at price on whichever side holds it
+        """
+        return self.bids.quantity_at(price) + self.asks.quantity_at(price)
+
+
+class OrderBookStream:
+    """
+    Maintains a LocalOrderBook for every symbol from combined @depth@100ms streams. The events of a symbol are
+    buffered while its snapshot downloads and a book which falls out of sequence, e.g. after a reconnect, is
+    resynced with a new snapshot. After a failed snapshot the events of the symbol are ignored until its retry time,
+    which backs off exponentially, so a failing endpoint is not asked for a snapshot on every diff.
+    """
+
+    def __init__(self, symbols, snapshot_limit=SNAPSHOT_LIMIT, logger=None, rate_limiter=None, session=None):
+        self.symbols = [s.upper() for s in symbols]
+        self.books = {s: LocalOrderBook(s) for s in self.symbols}
+        self.snapshot_limit = snapshot_limit
+        self.logger = get_logger("order_book_stream") if logger is None else logger
+        self.data_getters = {s: DataGetterSymbol(s, rate_limiter=rate_limiter, session=session) for s in self.symbols}
+        self.buffered = {s: [] for s in self.symbols}
+        self.resyncing = set()
+        # symbol -> (monotonic time of the next snapshot attempt, wait after which it was set)
+        self.retry_at = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.sockets = {}
+        self.threads = []
+
+    def stream_urls(self):
+        streams = [f"{s.lower()}@depth@100ms" for s in self.symbols]
+        return [BASE + "/stream?streams=" + "/".join(streams[i:i + STREAMS_PER_CONNECTION])
+                for i in range(0, len(streams), STREAMS_PER_CONNECTION)]
+
+    def _resync(self, symbol):
+        try:
+            snapshot = self.data_getters[symbol].get_partial_book_depth(self.snapshot_limit, save=False)
+        except Exception as err:
+            with self.lock:
+                wait = SNAPSHOT_RETRY_WAIT if symbol not in self.retry_at else \
+                    min(self.retry_at[symbol][1] * 2, MAX_RECONNECT_WAIT)
+                self.retry_at[symbol] = (time.monotonic() + wait, wait)
+                self.buffered[symbol] = []
+                self.resyncing.discard(symbol)
+            self.logger.error(f"{symbol}: snapshot failed {err}, retrying in {wait} seconds")
+            return
+        with self.lock:
+            book = self.books[symbol]
+            book.apply_snapshot(snapshot)
+            for event in self.buffered[symbol]:
+                if not book.apply_event(event):
+                    break
+            self.buffered[symbol] = []
+            self.resyncing.discard(symbol)
+            self.retry_at.pop(symbol, None)
+        self.logger.info(f"{symbol}: synced at {snapshot['lastUpdateId']}")
+
+    def on_message(self, ws, message):
+        try:
+            event = json.loads(message)['data']
+            symbol = event['s']
+        except Exception as err:
+            self.logger.error(f"could not decode {message[:200]}: {err}")
+            return
+        with self.lock:
+            if symbol in self.resyncing:
+                if len(self.buffered[symbol]) < MAX_BUFFERED_EVENTS:
+                    self.buffered[symbol].append(event)
+                return
+            if (symbol in self.retry_at) and (time.monotonic() < self.retry_at[symbol][0]):
+                return
+            if self.books[symbol].apply_event(event):
+                return
+            self.resyncing.add(symbol)
+            self.buffered[symbol] = [event]
+        threading.Thread(target=self._resync, args=(symbol,), daemon=True).start()
+
+    def _connection_loop(self, url):
+        wait = 1
+        while not self.stopped.is_set():
+            opened = threading.Event()
+            ws = websocket.WebSocketApp(url, on_open=lambda ws: opened.set(), on_message=self.on_message,
+                                        on_error=lambda ws, err: self.logger.error(f"{url[:80]}: {err}"))
+            self.sockets[url] = ws
+            self.logger.info(f"connecting {url[:80]}")
+            ws.run_forever(ping_interval=PING_INTERVAL)
+            if self.stopped.is_set():
+                break
+            wait = 1 if opened.is_set() else min(wait * 2, MAX_RECONNECT_WAIT)
+            self.logger.warning(f"connection closed, reconnecting in {wait} seconds")
+            self.stopped.wait(wait)
+
+    def book(self, symbol):
+        return self.books[symbol.upper()]
+
+    def start(self):
+        self.stopped.clear()
+        self.threads = [threading.Thread(target=self._connection_loop, args=(url,), daemon=True)
+                        for url in self.stream_urls()]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        for ws in list(self.sockets.values()):
+            ws.close()
+        for thread in self.threads:
+            thread.join()
+
+
+if __name__ == "__main__":
+    stream = OrderBookStream(["BTCUSDT", "ETHUSDT"])
+    stream.start()
+    while True:
+        time.sleep(5)
+        for s in stream.symbols:
+            print(s, stream.book(s).best_bid(), stream.book(s).best_ask(), stream.book(s).spread())